@@ -1,7 +1,267 @@
 #!/usr/bin/env python3
 import os, sys, argparse
+import multiprocessing
 import psycopg2
 
+# One connection per process, reused for every port that process builds
+_conn = None
+
+def open_build_conn(db, args, has_zone_mask):
+    """Connect and PREPARE the port build once; ports then only EXECUTE it."""
+    global _conn
+    _conn = psycopg2.connect(db)
+    _conn.autocommit = False
+    cur = _conn.cursor()
+    if args.work_mem:
+        cur.execute("SET work_mem = %s", (args.work_mem,))
+
+    def zone_pred(role, role_bit_param):
+        # Role membership decided inside the ais_positions join, so out-of-zone pings never
+        # reach ST_Point. Tagged points test their role bit in zone_mask (a point in
+        # overlapping QUEUE and BASIN zones carries both); only untagged points probe the
+        # GiST-indexed port_zone_subdiv tiles.
+        contains = f"""EXISTS (
+          SELECT 1
+          FROM public.port_zone_subdiv z
+          WHERE z.port_code = p.port_code
+            AND z.role = '{role}'
+            AND z.geom && ST_SetSRID(ST_Point(p.lon, p.lat), 4326)
+            AND ST_Contains(z.geom, ST_SetSRID(ST_Point(p.lon, p.lat), 4326))
+        )"""
+        if not has_zone_mask:
+            return contains
+        # A role without a bit yet (roles added after the last tagging pass) uses geometry only
+        return f"((p.zone_mask & {role_bit_param}) <> 0 OR ((p.zone_mask IS NULL OR {role_bit_param} IS NULL) AND {contains}))"
+
+    # SESSIONIZE berth calls first. Then compute queue/basin inside session window only.
+    # CTEs reused downstream are MATERIALIZED so PG12+ does not inline and re-run them.
+    sql = f"""
+    WITH touched AS MATERIALIZED (
+      -- Incremental ($7 set): vessels with any berth event starting or ending at/after the
+      -- watermark. Their whole since_days history is re-sessionized below, so a session that
+      -- straddles the watermark (or a still-open call whose end moved) is rebuilt in full,
+      -- never from a partial tail.
+      SELECT DISTINCT mmsi::text AS mmsi_txt
+      FROM public.{args.source_view}
+      WHERE port_code = $1
+        AND $7 IS NOT NULL
+        AND GREATEST(berth_start_utc, berth_end_utc) >= $7
+    ),
+    bc AS MATERIALIZED (
+      SELECT
+        port_code,
+        mmsi::text AS mmsi_txt,
+        berth_id,
+        berth_start_utc,
+        berth_end_utc,
+        alongside_hours
+      FROM public.{args.source_view}
+      WHERE port_code = $1
+        AND berth_start_utc >= (now() AT TIME ZONE 'utc') - make_interval(days => $2)
+        AND ($7 IS NULL OR mmsi::text IN (SELECT mmsi_txt FROM touched))
+        AND mmsi::text ~ '^[0-9]{{7,9}}$'
+    ),
+    ordered AS (
+      SELECT
+        *,
+        LAG(berth_end_utc) OVER (PARTITION BY port_code, mmsi_txt ORDER BY berth_start_utc) AS prev_end
+      FROM bc
+    ),
+    marked AS (
+      SELECT
+        *,
+        CASE
+          WHEN prev_end IS NULL THEN 1
+          WHEN EXTRACT(EPOCH FROM (berth_start_utc - prev_end)) > ($3 * 3600) THEN 1
+          ELSE 0
+        END AS is_new_sess
+      FROM ordered
+    ),
+    sess AS (
+      SELECT
+        *,
+        SUM(is_new_sess) OVER (PARTITION BY port_code, mmsi_txt ORDER BY berth_start_utc) AS sess_id
+      FROM marked
+    ),
+    sess_agg AS MATERIALIZED (
+      SELECT
+        port_code,
+        mmsi_txt,
+        sess_id,
+        MIN(berth_start_utc) AS first_berth_start_utc,
+        MAX(berth_end_utc)   AS last_berth_end_utc,
+        -- the session's opening row (is_new_sess = 1, by berth_start_utc) is its first berth:
+        -- reuses the LAG ordering, no extra window sort or array per group
+        MIN(berth_id) FILTER (WHERE is_new_sess = 1) AS berth_id_first,
+        SUM(COALESCE(alongside_hours,0)) AS alongside_hours_sum,
+        MIN(berth_start_utc) - make_interval(days => $4) AS win_start
+      FROM sess
+      GROUP BY port_code, mmsi_txt, sess_id
+    ),
+    pts_q AS (
+      SELECT s.port_code, s.mmsi_txt, s.sess_id, p.timestamp_utc
+      FROM sess_agg s
+      JOIN public.ais_positions p
+        ON p.port_code = s.port_code
+       AND p.mmsi::text = s.mmsi_txt
+       AND p.timestamp_utc >= s.win_start
+       AND p.timestamp_utc <= s.first_berth_start_utc
+      WHERE {zone_pred("QUEUE", "$5")}
+    ),
+    q AS MATERIALIZED (
+      SELECT
+        port_code, mmsi_txt, sess_id,
+        MIN(timestamp_utc) AS q_start
+      FROM pts_q
+      GROUP BY port_code, mmsi_txt, sess_id
+    ),
+    pts_b AS (
+      SELECT s.port_code, s.mmsi_txt, s.sess_id, s.win_start, p.timestamp_utc
+      FROM sess_agg s
+      JOIN public.ais_positions p
+        ON p.port_code = s.port_code
+       AND p.mmsi::text = s.mmsi_txt
+       AND p.timestamp_utc >= s.win_start
+       AND p.timestamp_utc <= s.first_berth_start_utc
+      WHERE {zone_pred("BASIN", "$6")}
+    ),
+    b AS MATERIALIZED (
+      SELECT
+        p.port_code, p.mmsi_txt, p.sess_id,
+        MIN(p.timestamp_utc) AS basin_start
+      FROM pts_b p
+      LEFT JOIN q
+        ON q.port_code=p.port_code AND q.mmsi_txt=p.mmsi_txt AND q.sess_id=p.sess_id
+      WHERE p.timestamp_utc >= COALESCE(q.q_start, p.win_start)
+      GROUP BY p.port_code, p.mmsi_txt, p.sess_id
+    ),
+    final AS (
+      SELECT
+        s.port_code,
+        s.mmsi_txt AS mmsi,
+        COALESCE(q.q_start, b.basin_start, s.first_berth_start_utc) AS call_start_utc,
+        s.last_berth_end_utc AS call_end_utc,
+        q.q_start AS anchorage_queue_start_utc,
+        b.basin_start AS basin_start_utc,
+        s.first_berth_start_utc AS berth_start_utc,
+        s.last_berth_end_utc    AS berth_end_utc,
+        s.berth_id_first AS berth_id,
+        CASE
+          WHEN q.q_start IS NOT NULL AND b.basin_start IS NOT NULL
+            THEN EXTRACT(EPOCH FROM (b.basin_start - q.q_start))/3600.0
+          ELSE NULL
+        END AS wait_hours,
+        CASE
+          WHEN b.basin_start IS NOT NULL
+            THEN EXTRACT(EPOCH FROM (s.first_berth_start_utc - b.basin_start))/3600.0
+          ELSE NULL
+        END AS ttb_hours,  -- also written as time_to_berth_hours (same value, computed once)
+        s.alongside_hours_sum AS alongside_hours,
+        $4::int AS lookback_days
+      FROM sess_agg s
+      LEFT JOIN q ON q.port_code=s.port_code AND q.mmsi_txt=s.mmsi_txt AND q.sess_id=s.sess_id
+      LEFT JOIN b ON b.port_code=s.port_code AND b.mmsi_txt=s.mmsi_txt AND b.sess_id=s.sess_id
+    ),
+    dedup AS (
+      -- Needed: ON CONFLICT DO UPDATE cannot touch one key twice in a statement (two
+      -- sessions can share a queue start). port_code is fixed ($1), so no need to sort on it.
+      SELECT *
+      FROM (
+        SELECT
+          *,
+          ROW_NUMBER() OVER (PARTITION BY mmsi, call_start_utc ORDER BY berth_start_utc) AS rn
+        FROM final
+      ) f
+      WHERE rn = 1
+    )
+    INSERT INTO public.port_calls_multiport (
+      port_code, mmsi,
+      call_start_utc, call_end_utc,
+      anchorage_queue_start_utc, basin_start_utc,
+      berth_id, berth_start_utc, berth_end_utc,
+      wait_hours, ttb_hours, time_to_berth_hours,
+      alongside_hours, lookback_days,
+      updated_at
+    )
+    SELECT
+      port_code, mmsi,
+      call_start_utc, call_end_utc,
+      anchorage_queue_start_utc, basin_start_utc,
+      berth_id, berth_start_utc, berth_end_utc,
+      wait_hours, ttb_hours, ttb_hours,
+      alongside_hours, lookback_days,
+      now()
+    FROM dedup
+    ON CONFLICT (port_code, mmsi, call_start_utc) DO UPDATE SET
+      call_end_utc = GREATEST(port_calls_multiport.call_end_utc, EXCLUDED.call_end_utc),
+      berth_end_utc = GREATEST(port_calls_multiport.berth_end_utc, EXCLUDED.berth_end_utc),
+      berth_start_utc = LEAST(port_calls_multiport.berth_start_utc, EXCLUDED.berth_start_utc),
+      berth_id = EXCLUDED.berth_id,
+      anchorage_queue_start_utc = COALESCE(port_calls_multiport.anchorage_queue_start_utc, EXCLUDED.anchorage_queue_start_utc),
+      basin_start_utc = COALESCE(port_calls_multiport.basin_start_utc, EXCLUDED.basin_start_utc),
+      wait_hours = EXCLUDED.wait_hours,
+      ttb_hours = EXCLUDED.ttb_hours,
+      time_to_berth_hours = EXCLUDED.time_to_berth_hours,
+      alongside_hours = EXCLUDED.alongside_hours,
+      lookback_days = EXCLUDED.lookback_days,
+      updated_at = now();
+    """
+
+    # Typed params: $1 port, $2 since_days, $3 gap_hours, $4 lookback_days, $5/$6 QUEUE/BASIN role bit,
+    # $7 incremental watermark: only vessels with berth events since then (NULL = every vessel)
+    cur.execute("PREPARE pc_build (text, int, int, int, smallint, smallint, timestamp) AS " + sql)
+    _conn.commit()
+    cur.close()
+
+def build_port(args, port, qid, bid):
+    """One port end to end on the process connection (ports share no rows)."""
+    conn = _conn
+    cur = conn.cursor()
+
+    print(f"\n[PORT_CALLS] port={port}")
+
+    if args.replace_since:
+        # Align delete with the unique key window: call_start_utc
+        cur.execute("""
+            DELETE FROM public.port_calls_multiport
+            WHERE port_code=%s
+              AND call_start_utc >= (now() AT TIME ZONE 'utc') - make_interval(days => %s)
+        """, (port, args.since_days))
+        conn.commit()
+        print(f"  [{port}] cleared existing port_calls by call_start_utc window")
+
+    # Incremental: only vessels with berth events since the last build (minus an overlap for
+    # late-arriving events), each rebuilt from its full history; the upsert is idempotent.
+    hwm = None
+    if args.incremental and not args.replace_since:
+        cur.execute("""
+            SELECT (MAX(updated_at) AT TIME ZONE 'utc') - make_interval(days => %s)
+            FROM public.port_calls_multiport
+            WHERE port_code=%s
+        """, (args.overlap_days, port))
+        hwm = cur.fetchone()[0]
+        print(f"  [{port}] incremental: vessels with berth events >= {hwm}" if hwm else f"  [{port}] no previous build, full window")
+
+    cur.execute("EXECUTE pc_build (%s, %s, %s, %s, %s, %s, %s)", (
+        port,
+        args.since_days,
+        args.session_gap_hours,
+        args.lookback_days,
+        qid,
+        bid,
+        hwm
+    ))
+    conn.commit()
+
+    cur.execute("""
+        SELECT COUNT(*) FROM public.port_calls_multiport
+        WHERE port_code=%s
+          AND call_start_utc >= (now() AT TIME ZONE 'utc') - make_interval(days => %s)
+    """, (port, args.since_days))
+    n = cur.fetchone()[0]
+    print(f"  [{port}] [OK] port_calls in window: {n}")
+    cur.close()
+
 def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("--ports", required=True)
@@ -10,6 +270,11 @@ def main():
     ap.add_argument("--session-gap-hours", type=int, default=12)
     ap.add_argument("--replace-since", action="store_true")
     ap.add_argument("--source-view", default="berth_calls_multiport_v1_ml")
+    ap.add_argument("--incremental", action="store_true", help="Only rebuild vessels with berth events since the last run (max updated_at - overlap)")
+    ap.add_argument("--overlap-days", type=int, default=2, help="Watermark margin for late-arriving berth events in --incremental (default 2)")
+    ap.add_argument("--workers", type=int, default=0, help="Parallel port builds, one connection each (0 = min(ports, CPUs))")
+    ap.add_argument("--work-mem", default=None, help="Session work_mem for the per-port builds (e.g. 256MB)")
+    ap.add_argument("--refresh-zones", action="store_true", help="Refresh port_zone_subdiv even if port_zones/roles look unchanged")
     args = ap.parse_args()
 
     db = os.getenv("DATABASE_URL")
@@ -27,21 +292,68 @@ def main():
     cur = conn.cursor()
 
     print("=== BUILD PORT CALLS MULTIPORT (SESSION-FIRST, NO LEAK, SAFE) ===")
-    print(f"ports={ports} since_days={args.since_days} lookback_days={args.lookback_days} gap_hours={args.session_gap_hours} replace={args.replace_since} source={args.source_view}")
+    print(f"ports={ports} since_days={args.since_days} lookback_days={args.lookback_days} gap_hours={args.session_gap_hours} replace={args.replace_since} incremental={args.incremental} source={args.source_view}")
 
-    for port in ports:
-        print(f"\n[PORT_CALLS] port={port}")
+    # QUEUE/BASIN role geometries cut into <=256-vertex tiles with a GiST index.
+    # Zones are tiled one by one (a collection, no ST_Union dissolve): containment only
+    # needs "inside any tile of the role".
+    cur.execute("""
+        CREATE MATERIALIZED VIEW IF NOT EXISTS public.port_zone_subdiv AS
+        SELECT
+          r.port_code,
+          r.role,
+          ST_Subdivide(z.geom, 256) AS geom
+        FROM public.port_zones z
+        JOIN public.port_zone_roles r
+          ON r.port_code=z.port_code AND r.zone_name=z.zone_name
+        WHERE r.active=true;
+        CREATE INDEX IF NOT EXISTS idx_port_zone_subdiv_geom ON public.port_zone_subdiv USING GIST (geom);
+        CREATE INDEX IF NOT EXISTS idx_port_zone_subdiv_port_role ON public.port_zone_subdiv (port_code, role);
+        CREATE TABLE IF NOT EXISTS public.port_zone_versions (
+          port_code text PRIMARY KEY,
+          subdiv_fp text,
+          mask_fp text
+        );
+    """)
 
-        if args.replace_since:
-            # Align delete with the unique key window: call_start_utc
+    # REFRESH holds ACCESS EXCLUSIVE on the tiles (blocking the tagger and other builds
+    # reading them), so only refresh when the active zones/roles differ from the ones the
+    # tiles were built from: one fingerprint per port over exactly the view's inputs.
+    cur.execute("""
+        SELECT
+          r.port_code,
+          md5(string_agg(r.role || ':' || z.zone_name || ':' || md5(ST_AsEWKB(z.geom)), ',' ORDER BY r.role, z.zone_name))
+        FROM public.port_zones z
+        JOIN public.port_zone_roles r
+          ON r.port_code=z.port_code AND r.zone_name=z.zone_name
+        WHERE r.active=true
+        GROUP BY r.port_code
+    """)
+    zone_fps = dict(cur.fetchall())
+    cur.execute("SELECT port_code, subdiv_fp FROM public.port_zone_versions WHERE subdiv_fp IS NOT NULL")
+    if args.refresh_zones or dict(cur.fetchall()) != zone_fps:
+        print("[ZONES] port_zones/roles changed since the last refresh: refreshing port_zone_subdiv")
+        cur.execute("REFRESH MATERIALIZED VIEW public.port_zone_subdiv")
+        cur.execute("UPDATE public.port_zone_versions SET subdiv_fp = NULL")
+        for port_code, fp in zone_fps.items():
             cur.execute("""
-                DELETE FROM public.port_calls_multiport
-                WHERE port_code=%s
-                  AND call_start_utc >= (now() AT TIME ZONE 'utc') - (%s || ' days')::interval
-            """, (port, args.since_days))
-            conn.commit()
-            print("  cleared existing port_calls by call_start_utc window")
+                INSERT INTO public.port_zone_versions (port_code, subdiv_fp) VALUES (%s, %s)
+                ON CONFLICT (port_code) DO UPDATE SET subdiv_fp = EXCLUDED.subdiv_fp
+            """, (port_code, fp))
+    conn.commit()
+
+    cur.execute("""
+        SELECT to_regclass('public.port_zone_role_ids') IS NOT NULL
+           AND EXISTS (
+             SELECT 1 FROM information_schema.columns
+             WHERE table_schema='public' AND table_name='ais_positions' AND column_name='zone_mask'
+           )
+    """)
+    has_zone_mask = cur.fetchone()[0]
 
+    # Validate every port up front, then fan the heavy per-port builds out
+    jobs = []
+    for port in ports:
         # Ensure roles exist
         cur.execute("""
             SELECT COUNT(*)
@@ -51,203 +363,63 @@ def main():
         if cur.fetchone()[0] == 0:
             raise SystemExit(f"ERROR: no port_zone_roles for {port}. Define QUEUE/BASIN roles first.")
 
-        # Build QUEUE & BASIN union geometries
+        # Ensure subdivided QUEUE & BASIN tiles exist
         cur.execute("""
-            WITH q AS (
-              SELECT ST_Union(z.geom) AS geom
-              FROM public.port_zones z
-              JOIN public.port_zone_roles r
-                ON r.port_code=z.port_code AND r.zone_name=z.zone_name
-              WHERE z.port_code=%s AND r.active=true AND r.role='QUEUE'
-            ),
-            b AS (
-              SELECT ST_Union(z.geom) AS geom
-              FROM public.port_zones z
-              JOIN public.port_zone_roles r
-                ON r.port_code=z.port_code AND r.zone_name=z.zone_name
-              WHERE z.port_code=%s AND r.active=true AND r.role='BASIN'
-            )
-            SELECT (SELECT geom FROM q), (SELECT geom FROM b);
-        """, (port, port))
-        qgeom, bgeom = cur.fetchone()
-        if qgeom is None:
+            SELECT
+              COALESCE(bool_or(role='QUEUE'), false),
+              COALESCE(bool_or(role='BASIN'), false)
+            FROM public.port_zone_subdiv
+            WHERE port_code=%s
+        """, (port,))
+        has_q, has_b = cur.fetchone()
+        if not has_q:
             raise SystemExit(f"ERROR: No QUEUE geometry for {port} (role='QUEUE').")
-        if bgeom is None:
+        if not has_b:
             raise SystemExit(f"ERROR: No BASIN geometry for {port} (role='BASIN').")
 
-        # SESSIONIZE berth calls first. Then compute queue/basin inside session window only.
-        sql = f"""
-        WITH bc AS (
-          SELECT
-            port_code,
-            mmsi::text AS mmsi_txt,
-            berth_id,
-            berth_start_utc,
-            berth_end_utc,
-            alongside_hours
-          FROM public.{args.source_view}
-          WHERE port_code = %s
-            AND berth_start_utc >= (now() AT TIME ZONE 'utc') - (%s || ' days')::interval
-            AND mmsi::text ~ '^[0-9]{{7,9}}$'
-        ),
-        ordered AS (
-          SELECT
-            *,
-            LAG(berth_end_utc) OVER (PARTITION BY port_code, mmsi_txt ORDER BY berth_start_utc) AS prev_end
-          FROM bc
-        ),
-        marked AS (
-          SELECT
-            *,
-            CASE
-              WHEN prev_end IS NULL THEN 1
-              WHEN EXTRACT(EPOCH FROM (berth_start_utc - prev_end)) > (%s * 3600) THEN 1
-              ELSE 0
-            END AS is_new_sess
-          FROM ordered
-        ),
-        sess AS (
-          SELECT
-            *,
-            SUM(is_new_sess) OVER (PARTITION BY port_code, mmsi_txt ORDER BY berth_start_utc) AS sess_id
-          FROM marked
-        ),
-        sess_agg AS (
-          SELECT
-            port_code,
-            mmsi_txt,
-            sess_id,
-            MIN(berth_start_utc) AS first_berth_start_utc,
-            MAX(berth_end_utc)   AS last_berth_end_utc,
-            (ARRAY_AGG(berth_id ORDER BY berth_start_utc))[1] AS berth_id_first,
-            SUM(COALESCE(alongside_hours,0)) AS alongside_hours_sum,
-            MIN(berth_start_utc) - (%s || ' days')::interval AS win_start
-          FROM sess
-          GROUP BY port_code, mmsi_txt, sess_id
-        ),
-        pts AS (
-          SELECT
-            s.port_code, s.mmsi_txt, s.sess_id,
-            p.timestamp_utc,
-            ST_SetSRID(ST_Point(p.lon, p.lat), 4326) AS pt
-          FROM sess_agg s
-          JOIN public.ais_positions p
-            ON p.port_code = s.port_code
-           AND p.mmsi::text = s.mmsi_txt
-           AND p.timestamp_utc >= s.win_start
-           AND p.timestamp_utc <= s.first_berth_start_utc
-        ),
-        q AS (
-          SELECT
-            port_code, mmsi_txt, sess_id,
-            MIN(timestamp_utc) AS q_start
-          FROM pts
-          WHERE ST_Contains(%s::geometry, pt)
-          GROUP BY port_code, mmsi_txt, sess_id
-        ),
-        b AS (
-          SELECT
-            p.port_code, p.mmsi_txt, p.sess_id,
-            MIN(p.timestamp_utc) AS basin_start
-          FROM pts p
-          LEFT JOIN q
-            ON q.port_code=p.port_code AND q.mmsi_txt=p.mmsi_txt AND q.sess_id=p.sess_id
-          WHERE ST_Contains(%s::geometry, p.pt)
-            AND p.timestamp_utc >= COALESCE(q.q_start, (SELECT win_start FROM sess_agg s2 WHERE s2.port_code=p.port_code AND s2.mmsi_txt=p.mmsi_txt AND s2.sess_id=p.sess_id))
-          GROUP BY p.port_code, p.mmsi_txt, p.sess_id
-        ),
-        final AS (
-          SELECT
-            s.port_code,
-            s.mmsi_txt AS mmsi,
-            COALESCE(q.q_start, b.basin_start, s.first_berth_start_utc) AS call_start_utc,
-            s.last_berth_end_utc AS call_end_utc,
-            q.q_start AS anchorage_queue_start_utc,
-            b.basin_start AS basin_start_utc,
-            s.first_berth_start_utc AS berth_start_utc,
-            s.last_berth_end_utc    AS berth_end_utc,
-            s.berth_id_first AS berth_id,
-            CASE
-              WHEN q.q_start IS NOT NULL AND b.basin_start IS NOT NULL
-                THEN EXTRACT(EPOCH FROM (b.basin_start - q.q_start))/3600.0
-              ELSE NULL
-            END AS wait_hours,
-            CASE
-              WHEN b.basin_start IS NOT NULL
-                THEN EXTRACT(EPOCH FROM (s.first_berth_start_utc - b.basin_start))/3600.0
-              ELSE NULL
-            END AS ttb_hours,
-            CASE
-              WHEN b.basin_start IS NOT NULL
-                THEN EXTRACT(EPOCH FROM (s.first_berth_start_utc - b.basin_start))/3600.0
-              ELSE NULL
-            END AS time_to_berth_hours,
-            s.alongside_hours_sum AS alongside_hours,
-            %s::int AS lookback_days
-          FROM sess_agg s
-          LEFT JOIN q ON q.port_code=s.port_code AND q.mmsi_txt=s.mmsi_txt AND q.sess_id=s.sess_id
-          LEFT JOIN b ON b.port_code=s.port_code AND b.mmsi_txt=s.mmsi_txt AND b.sess_id=s.sess_id
-        ),
-        dedup AS (
-          SELECT DISTINCT ON (port_code, mmsi, call_start_utc)
-            *
-          FROM final
-          ORDER BY port_code, mmsi, call_start_utc, berth_start_utc
-        )
-        INSERT INTO public.port_calls_multiport (
-          port_code, mmsi,
-          call_start_utc, call_end_utc,
-          anchorage_queue_start_utc, basin_start_utc,
-          berth_id, berth_start_utc, berth_end_utc,
-          wait_hours, ttb_hours, time_to_berth_hours,
-          alongside_hours, lookback_days,
-          updated_at
-        )
-        SELECT
-          port_code, mmsi,
-          call_start_utc, call_end_utc,
-          anchorage_queue_start_utc, basin_start_utc,
-          berth_id, berth_start_utc, berth_end_utc,
-          wait_hours, ttb_hours, time_to_berth_hours,
-          alongside_hours, lookback_days,
-          now()
-        FROM dedup
-        ON CONFLICT (port_code, mmsi, call_start_utc) DO UPDATE SET
-          call_end_utc = GREATEST(port_calls_multiport.call_end_utc, EXCLUDED.call_end_utc),
-          berth_end_utc = GREATEST(port_calls_multiport.berth_end_utc, EXCLUDED.berth_end_utc),
-          berth_start_utc = LEAST(port_calls_multiport.berth_start_utc, EXCLUDED.berth_start_utc),
-          berth_id = EXCLUDED.berth_id,
-          anchorage_queue_start_utc = COALESCE(port_calls_multiport.anchorage_queue_start_utc, EXCLUDED.anchorage_queue_start_utc),
-          basin_start_utc = COALESCE(port_calls_multiport.basin_start_utc, EXCLUDED.basin_start_utc),
-          wait_hours = EXCLUDED.wait_hours,
-          ttb_hours = EXCLUDED.ttb_hours,
-          time_to_berth_hours = EXCLUDED.time_to_berth_hours,
-          alongside_hours = EXCLUDED.alongside_hours,
-          lookback_days = EXCLUDED.lookback_days,
-          updated_at = now();
-        """
-
-        cur.execute(sql, (
-            port,
-            args.since_days,
-            args.session_gap_hours,
-            args.lookback_days,
-            qgeom,
-            bgeom,
-            args.lookback_days
-        ))
-        conn.commit()
-
-        cur.execute("""
-            SELECT COUNT(*) FROM public.port_calls_multiport
-            WHERE port_code=%s
-              AND call_start_utc >= (now() AT TIME ZONE 'utc') - (%s || ' days')::interval
-        """, (port, args.since_days))
-        n = cur.fetchone()[0]
-        print(f"  [OK] port_calls in window: {n}")
+        # Pre-tagged role membership (tag_ais_zone_ids_multiport.py): tagged points test a
+        # zone_mask bit; untagged (NULL) points fall back to ST_Contains on the tiles.
+        # Bits are assigned exactly as the tagger does (rank of zone_id within the port).
+        # Masks tagged under other zones/roles than the current ones are ignored (no bits:
+        # every point takes the geometry path) until the tagger re-tags the port.
+        qid = bid = None
+        mask_current = False
+        if has_zone_mask:
+            cur.execute("SELECT mask_fp FROM public.port_zone_versions WHERE port_code=%s", (port,))
+            row = cur.fetchone()
+            mask_current = row is not None and row[0] == zone_fps.get(port)
+            if not mask_current:
+                print(f"[WARN] {port}: zones/roles changed since zone_mask was tagged; using geometry only "
+                      f"(run tag_ais_zone_ids_multiport.py --ports {port})")
+        if mask_current:
+            cur.execute("""
+                WITH role_bits AS (
+                  SELECT role,
+                         (1 << (ROW_NUMBER() OVER (ORDER BY zone_id) - 1)::int)::smallint AS bit
+                  FROM public.port_zone_role_ids
+                  WHERE port_code=%s
+                )
+                SELECT
+                  MAX(bit) FILTER (WHERE role='QUEUE'),
+                  MAX(bit) FILTER (WHERE role='BASIN')
+                FROM role_bits
+            """, (port,))
+            qid, bid = cur.fetchone()
+        jobs.append((args, port, qid, bid))
 
     cur.close()
     conn.close()
+
+    workers = args.workers or min(len(jobs), os.cpu_count() or 1)
+    if workers <= 1:
+        open_build_conn(db, args, has_zone_mask)
+        for job in jobs:
+            build_port(*job)
+        _conn.close()
+    else:
+        with multiprocessing.Pool(min(workers, len(jobs)), initializer=open_build_conn,
+                                  initargs=(db, args, has_zone_mask)) as pool:
+            pool.starmap(build_port, jobs)
     print("\n=== DONE BUILD PORT CALLS MULTIPORT ===")
 
 if __name__ == "__main__":
@@ -2,7 +2,11 @@
 from __future__ import annotations
 
 import os
+import io
+import csv
 import argparse
+import multiprocessing
+from datetime import timedelta
 from sqlalchemy import create_engine, text
 
 DB_URL = os.getenv("DATABASE_URL")
@@ -11,6 +15,188 @@ if not DB_URL:
 
 engine = create_engine(DB_URL, pool_pre_ping=True)
 
+# Congestion counts come from ONE pass over ais_positions (widest window),
+# split per role/window with FILTER instead of one correlated scan per feature.
+CONGESTION_EXACT_SQL = """
+    ap_join AS MATERIALIZED (
+      SELECT
+        pc.id,
+        pc.basin_start_utc,
+        r.role,
+        ap.mmsi,
+        ap.timestamp_utc
+      FROM pc
+      JOIN public.ais_positions ap
+        ON ap.port_code = pc.port_code
+       AND ap.timestamp_utc >  pc.basin_start_utc - GREATEST(interval '6 hours', make_interval(mins => :wmin))
+       AND ap.timestamp_utc <= pc.basin_start_utc
+      JOIN public.port_zone_roles r
+        ON r.port_code = ap.port_code
+       AND r.zone_name = ap.zone
+       AND r.role IN ('QUEUE', 'BASIN', 'HOLDING')
+      WHERE ap.zone IS NOT NULL
+        AND ap.mmsi ~ '^[0-9]{7,9}$'
+    ),
+    cong AS (
+      SELECT
+        id,
+        -- congestion now (distinct MMSI in role zones within window-min)
+        COUNT(DISTINCT mmsi) FILTER (WHERE role = 'QUEUE'   AND timestamp_utc > basin_start_utc - make_interval(mins => :wmin)) AS queue_mmsi_30m,
+        COUNT(DISTINCT mmsi) FILTER (WHERE role = 'BASIN'   AND timestamp_utc > basin_start_utc - make_interval(mins => :wmin)) AS basin_mmsi_30m,
+        COUNT(DISTINCT mmsi) FILTER (WHERE role = 'HOLDING' AND timestamp_utc > basin_start_utc - make_interval(mins => :wmin)) AS holding_mmsi_30m,
+        -- longer state (6h) helps heavy tail (still leak-safe)
+        COUNT(DISTINCT mmsi) FILTER (WHERE role = 'QUEUE'   AND timestamp_utc > basin_start_utc - interval '6 hours') AS queue_mmsi_6h,
+        COUNT(DISTINCT mmsi) FILTER (WHERE role = 'BASIN'   AND timestamp_utc > basin_start_utc - interval '6 hours') AS basin_mmsi_6h
+      FROM ap_join
+      GROUP BY id
+    )
+"""
+
+# --approx-distinct: merge per-minute HLL sketches instead of hashing raw AIS points.
+# Only full minutes strictly before label_ts_utc are used, so it stays leak-safe.
+CONGESTION_HLL_SQL = """
+    hll_join AS MATERIALIZED (
+      SELECT
+        pc.id,
+        pc.basin_start_utc,
+        r.role,
+        h.minute_bucket,
+        h.mmsi_hll
+      FROM pc
+      JOIN public.ais_zone_minute_hll h
+        ON h.port_code = pc.port_code
+       AND h.minute_bucket >= pc.basin_start_utc - GREATEST(interval '6 hours', make_interval(mins => :wmin))
+       AND h.minute_bucket <  date_trunc('minute', pc.basin_start_utc)
+      JOIN public.port_zone_roles r
+        ON r.port_code = h.port_code
+       AND r.zone_name = h.zone
+       AND r.role IN ('QUEUE', 'BASIN', 'HOLDING')
+    ),
+    cong AS (
+      SELECT
+        id,
+        hll_cardinality(hll_union_agg(mmsi_hll) FILTER (WHERE role = 'QUEUE'   AND minute_bucket >= basin_start_utc - make_interval(mins => :wmin)))::bigint AS queue_mmsi_30m,
+        hll_cardinality(hll_union_agg(mmsi_hll) FILTER (WHERE role = 'BASIN'   AND minute_bucket >= basin_start_utc - make_interval(mins => :wmin)))::bigint AS basin_mmsi_30m,
+        hll_cardinality(hll_union_agg(mmsi_hll) FILTER (WHERE role = 'HOLDING' AND minute_bucket >= basin_start_utc - make_interval(mins => :wmin)))::bigint AS holding_mmsi_30m,
+        hll_cardinality(hll_union_agg(mmsi_hll) FILTER (WHERE role = 'QUEUE'   AND minute_bucket >= basin_start_utc - interval '6 hours'))::bigint AS queue_mmsi_6h,
+        hll_cardinality(hll_union_agg(mmsi_hll) FILTER (WHERE role = 'BASIN'   AND minute_bucket >= basin_start_utc - interval '6 hours'))::bigint AS basin_mmsi_6h
+      FROM hll_join
+      GROUP BY id
+    )
+"""
+
+LABEL_COLS = ("port_code", "mmsi", "label_ts_utc", "label_type", "label_wait_hours", "features")
+CONGESTION_KEYS = ("queue_mmsi_30m", "basin_mmsi_30m", "holding_mmsi_30m", "queue_mmsi_6h", "basin_mmsi_6h")
+COPY_CHUNK_ROWS = 10000
+
+try:
+    import orjson
+
+    def dumps_json(obj) -> str:
+        return orjson.dumps(obj).decode()
+except ImportError:
+    import json
+
+    def dumps_json(obj) -> str:
+        return json.dumps(obj, separators=(",", ":"))
+
+def label_row(r) -> tuple:
+    """Assemble the features jsonb client-side (keeps the PG backend on the scans)."""
+    features = {
+        "hour_utc": r.hour_utc,
+        "dow_utc": r.dow_utc,
+        "month_utc": r.month_utc,
+        "is_weekend": 1 if r.dow_utc in (0, 6) else 0,
+    }
+    for k in CONGESTION_KEYS:
+        features[k] = getattr(r, k)
+    return (r.port_code, r.mmsi, r.label_ts_utc, "TTB", r.label_wait_hours, dumps_json(features))
+
+def copy_labels_batch(conn, labels_sql, params) -> int:
+    """
+    Stream one batch of label rows through a server-side cursor, COPY them into a
+    session-private staging table, then land them with a single INSERT ... SELECT.
+    """
+    cols = ", ".join(LABEL_COLS)
+    conn.execute(text("""
+        CREATE TEMP TABLE ttb_labels_stg (
+          port_code text,
+          mmsi text,
+          label_ts_utc timestamptz,
+          label_type text,
+          label_wait_hours double precision,
+          features jsonb
+        ) ON COMMIT DROP;
+    """))
+    # Streaming goes on the statement: Connection.execution_options() mutates the connection
+    # in place on SQLAlchemy 2.x, which would also turn the INSERT below into a named cursor
+    rows = conn.execute(labels_sql.execution_options(stream_results=True, yield_per=COPY_CHUNK_ROWS), params)
+    cur = conn.connection.cursor()
+    for chunk in rows.partitions():
+        buf = io.StringIO()
+        csv.writer(buf).writerows(label_row(r) for r in chunk)
+        buf.seek(0)
+        cur.copy_expert(f"COPY ttb_labels_stg ({cols}) FROM STDIN WITH (FORMAT csv)", buf)
+    return conn.execute(text(f"""
+        INSERT INTO public.ml_training_samples_multiport ({cols})
+        SELECT {cols} FROM ttb_labels_stg;
+    """)).rowcount
+
+def _init_worker() -> None:
+    # Forked workers must not reuse the parent's pooled connections
+    engine.dispose(close=False)
+
+def build_port_labels(port: str, args, labels_sql: str) -> None:
+    """All label batches for one port (ports are independent; safe to run in parallel)."""
+    stmt = text(labels_sql)
+    if args.replace_since:
+        with engine.begin() as conn:
+            conn.execute(text("""
+                DELETE FROM public.ml_training_samples_multiport
+                WHERE port_code = :p
+                  AND label_type = 'TTB'
+                  AND label_ts_utc >= (now() AT TIME ZONE 'utc') - make_interval(days => :d)
+            """), {"p": port, "d": args.since_days})
+        print(f"[TTB] {port}: cleared existing samples in window")
+
+    with engine.begin() as conn:
+        since_ts, now_ts = conn.execute(text("""
+            SELECT (now() AT TIME ZONE 'utc') - make_interval(days => :d),
+                   (now() AT TIME ZONE 'utc')
+        """), {"d": args.since_days}).one()
+
+    # Slice the window by basin_start_utc so each statement plans a bounded
+    # batch (better estimates, parallel workers per batch, progress output).
+    # Each slice is its own short transaction, so long backfills don't hold back vacuum.
+    step = timedelta(days=args.batch_days)
+    lo = since_ts
+    while lo < now_ts:
+        hi = lo + step if lo + step < now_ts else None
+        with engine.begin() as conn:
+            inserted = copy_labels_batch(conn, stmt, {"p": port, "lo": lo, "hi": hi, "cap": float(args.cap_hours), "wmin": int(args.window_min)})
+        print(f"[TTB] {port}: batch {lo:%Y-%m-%d} -> {(hi or now_ts):%Y-%m-%d} inserted={inserted}")
+        if hi is None:
+            break
+        lo = hi
+
+    with engine.begin() as conn:
+        n = conn.execute(text("""
+            SELECT COUNT(*)
+            FROM public.ml_training_samples_multiport
+            WHERE port_code=:p AND label_type='TTB'
+              AND label_ts_utc >= (now() AT TIME ZONE 'utc') - make_interval(days => :d)
+        """), {"p": port, "d": args.since_days}).scalar()
+
+    print(f"[TTB] {port}: samples_in_window={n}")
+
+def has_column(conn, table: str, column: str) -> bool:
+    return conn.execute(text("""
+        SELECT EXISTS (
+          SELECT 1 FROM information_schema.columns
+          WHERE table_schema='public' AND table_name=:t AND column_name=:c
+        )
+    """), {"t": table, "c": column}).scalar()
+
 def parse_ports(s: str):
     return [p.strip().upper() for p in (s or "").split(",") if p.strip()]
 
@@ -21,14 +207,22 @@ def main() -> None:
     ap.add_argument("--replace-since", action="store_true")
     ap.add_argument("--cap-hours", type=float, default=336.0, help="Drop labels above this (default 14d)")
     ap.add_argument("--window-min", type=int, default=30, help="Window (minutes) for 'now' congestion features (default 30)")
+    ap.add_argument("--workers", type=int, default=0, help="Parallel ports, one connection each (0 = min(ports, CPUs))")
+    ap.add_argument("--batch-days", type=int, default=7, help="Slice size (days of basin_start_utc) per INSERT batch (default 7)")
+    ap.add_argument("--approx-distinct", action="store_true", help="Approximate congestion counts from HLL sketches (needs the hll extension)")
+    ap.add_argument("--skip-hll-refresh", action="store_true", help="Do not top up ais_zone_minute_hll (e.g., maintained by pg_cron)")
+    ap.add_argument("--hll-lag-hours", type=int, default=24, help="Re-aggregate this many hours before the newest stored HLL minute (late-arriving AIS; default 24)")
+    ap.add_argument("--rebuild-hll", action="store_true", help="Drop the ports' ais_zone_minute_hll rows and re-aggregate the whole window (AIS backfilled older than --hll-lag-hours)")
     args = ap.parse_args()
 
     ports = parse_ports(args.ports)
     if not ports:
         raise SystemExit("no ports")
+    if args.batch_days <= 0:
+        raise SystemExit("--batch-days must be > 0")
 
     print("=== BUILD TTB LABELS -> ml_training_samples_multiport ===")
-    print(f"ports={ports} since_days={args.since_days} replace={args.replace_since} cap_hours={args.cap_hours} window_min={args.window_min}")
+    print(f"ports={ports} since_days={args.since_days} replace={args.replace_since} cap_hours={args.cap_hours} window_min={args.window_min} approx_distinct={args.approx_distinct}")
 
     # Create table if missing (does not modify existing)
     with engine.begin() as conn:
@@ -45,129 +239,157 @@ def main() -> None:
         );
         """))
 
-    for port in ports:
+    # Numeric MMSI on port_calls_multiport, computed once per row on write instead of
+    # a regex per row on every label build (port_calls_multiport is small; one-off rewrite).
+    # ADD COLUMN IF NOT EXISTS still takes ACCESS EXCLUSIVE, so only issue it when missing.
+    with engine.begin() as conn:
+        if not has_column(conn, "port_calls_multiport", "mmsi_num"):
+            conn.execute(text("""
+            ALTER TABLE public.port_calls_multiport
+              ADD COLUMN IF NOT EXISTS mmsi_num bigint
+              GENERATED ALWAYS AS (CASE WHEN mmsi ~ '^[0-9]{7,9}$' THEN mmsi::bigint END) STORED;
+            """))
+
+    # Anti-tug / min-length ML filter, evaluated once per vessel_info write instead of an
+    # ILIKE per label row (vessel_info is small; one-off rewrite). Guarded like mmsi_num:
+    # the enrichment job can hold vessel_info open for hours, and a queued ALTER would
+    # block every later reader behind it.
+    with engine.begin() as conn:
+        if not has_column(conn, "vessel_info", "ml_eligible"):
+            conn.execute(text("""
+            ALTER TABLE public.vessel_info
+              ADD COLUMN IF NOT EXISTS ml_eligible boolean
+              GENERATED ALWAYS AS (
+                (vessel_type IS NULL OR vessel_type NOT ILIKE '%tug%')
+                AND (length_m IS NULL OR length_m >= 70)
+              ) STORED;
+            """))
+
+    # Partial index whose predicate repeats the label filter verbatim, so the planner proves
+    # it and seeks instead of re-checking mmsi per row. CONCURRENTLY needs autocommit.
+    # (The ais_positions congestion scan is served by idx_ais_pos_port_time_cover, created
+    # once by migrations/001_ais_positions_port_time_cover.sql.)
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text("""
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_port_calls_port_basin_validmmsi
+          ON public.port_calls_multiport (port_code, basin_start_utc)
+          WHERE mmsi_num IS NOT NULL;
+        """))
+
+    congestion_sql = CONGESTION_EXACT_SQL
+    if args.approx_distinct:
+        # Per-minute distinct-MMSI sketches per zone (~1-2 KB each), merged per label window.
+        # A plain table maintained incrementally per port: only minutes this run's window
+        # needs and the table lacks, plus a trailing lag window, are aggregated (never a
+        # rebuild over all ais_positions unless --rebuild-hll).
         with engine.begin() as conn:
-            if args.replace_since:
-                conn.execute(text("""
-                    DELETE FROM public.ml_training_samples_multiport
-                    WHERE port_code = :p
-                      AND label_type = 'TTB'
-                      AND label_ts_utc >= (now() AT TIME ZONE 'utc') - (:d || ' days')::interval
-                """), {"p": port, "d": args.since_days})
-                print(f"[TTB] {port}: cleared existing samples in window")
-
-            # Leak-safe features:
-            # - label_ts_utc = pc.basin_start_utc
-            # - congestion uses only AIS points <= label_ts_utc (lookback windows)
-            # IMPORTANT type cast: vessel_info.mmsi is BIGINT, port_calls_multiport.mmsi is TEXT
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS hll;"))
+            conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS public.ais_zone_minute_hll AS
+            SELECT
+              port_code,
+              zone,
+              date_trunc('minute', timestamp_utc) AS minute_bucket,
+              hll_add_agg(hll_hash_text(mmsi)) AS mmsi_hll
+            FROM public.ais_positions
+            WHERE zone IS NOT NULL
+              AND mmsi ~ '^[0-9]{7,9}$'
+            GROUP BY 1, 2, 3
+            WITH NO DATA;
+            """))
             conn.execute(text("""
-                INSERT INTO public.ml_training_samples_multiport
-                  (port_code, mmsi, label_ts_utc, label_type, label_wait_hours, features)
-                SELECT
-                  pc.port_code,
-                  pc.mmsi,
-                  pc.basin_start_utc AS label_ts_utc,
-                  'TTB' AS label_type,
-                  pc.time_to_berth_hours AS label_wait_hours,
-                  jsonb_build_object(
-                    -- calendar (UTC)
-                    'hour_utc',  EXTRACT(HOUR  FROM (pc.basin_start_utc AT TIME ZONE 'utc')),
-                    'dow_utc',   EXTRACT(DOW   FROM (pc.basin_start_utc AT TIME ZONE 'utc')),
-                    'month_utc', EXTRACT(MONTH FROM (pc.basin_start_utc AT TIME ZONE 'utc')),
-                    'is_weekend', CASE WHEN EXTRACT(DOW FROM (pc.basin_start_utc AT TIME ZONE 'utc')) IN (0,6) THEN 1 ELSE 0 END,
-
-                    -- congestion now (distinct MMSI in role zones within window-min)
-                    'queue_mmsi_30m', (
-                      SELECT COUNT(DISTINCT ap.mmsi)
-                      FROM public.ais_positions ap
-                      JOIN public.port_zone_roles r
-                        ON r.port_code = ap.port_code
-                       AND r.zone_name = ap.zone
-                       AND r.role = 'QUEUE'
-                      WHERE ap.port_code = pc.port_code
-                        AND ap.zone IS NOT NULL
-                        AND ap.timestamp_utc >  pc.basin_start_utc - (:wmin || ' minutes')::interval
-                        AND ap.timestamp_utc <= pc.basin_start_utc
-                        AND ap.mmsi ~ '^[0-9]{7,9}$'
-                    ),
-                    'basin_mmsi_30m', (
-                      SELECT COUNT(DISTINCT ap.mmsi)
-                      FROM public.ais_positions ap
-                      JOIN public.port_zone_roles r
-                        ON r.port_code = ap.port_code
-                       AND r.zone_name = ap.zone
-                       AND r.role = 'BASIN'
-                      WHERE ap.port_code = pc.port_code
-                        AND ap.zone IS NOT NULL
-                        AND ap.timestamp_utc >  pc.basin_start_utc - (:wmin || ' minutes')::interval
-                        AND ap.timestamp_utc <= pc.basin_start_utc
-                        AND ap.mmsi ~ '^[0-9]{7,9}$'
-                    ),
-                    'holding_mmsi_30m', (
-                      SELECT COUNT(DISTINCT ap.mmsi)
-                      FROM public.ais_positions ap
-                      JOIN public.port_zone_roles r
-                        ON r.port_code = ap.port_code
-                       AND r.zone_name = ap.zone
-                       AND r.role = 'HOLDING'
-                      WHERE ap.port_code = pc.port_code
-                        AND ap.zone IS NOT NULL
-                        AND ap.timestamp_utc >  pc.basin_start_utc - (:wmin || ' minutes')::interval
-                        AND ap.timestamp_utc <= pc.basin_start_utc
-                        AND ap.mmsi ~ '^[0-9]{7,9}$'
-                    ),
-
-                    -- longer state (6h) helps heavy tail (still leak-safe)
-                    'queue_mmsi_6h', (
-                      SELECT COUNT(DISTINCT ap.mmsi)
-                      FROM public.ais_positions ap
-                      JOIN public.port_zone_roles r
-                        ON r.port_code = ap.port_code
-                       AND r.zone_name = ap.zone
-                       AND r.role = 'QUEUE'
-                      WHERE ap.port_code = pc.port_code
-                        AND ap.zone IS NOT NULL
-                        AND ap.timestamp_utc >  pc.basin_start_utc - interval '6 hours'
-                        AND ap.timestamp_utc <= pc.basin_start_utc
-                        AND ap.mmsi ~ '^[0-9]{7,9}$'
-                    ),
-                    'basin_mmsi_6h', (
-                      SELECT COUNT(DISTINCT ap.mmsi)
-                      FROM public.ais_positions ap
-                      JOIN public.port_zone_roles r
-                        ON r.port_code = ap.port_code
-                       AND r.zone_name = ap.zone
-                       AND r.role = 'BASIN'
-                      WHERE ap.port_code = pc.port_code
-                        AND ap.zone IS NOT NULL
-                        AND ap.timestamp_utc >  pc.basin_start_utc - interval '6 hours'
-                        AND ap.timestamp_utc <= pc.basin_start_utc
-                        AND ap.mmsi ~ '^[0-9]{7,9}$'
+            CREATE UNIQUE INDEX IF NOT EXISTS ux_ais_zone_minute_hll
+              ON public.ais_zone_minute_hll (port_code, zone, minute_bucket);
+            """))
+        if not args.skip_hll_refresh:
+            for port in ports:
+                with engine.begin() as conn:
+                    if args.rebuild_hll:
+                        conn.execute(text("DELETE FROM public.ais_zone_minute_hll WHERE port_code = :p"), {"p": port})
+                    # Fill [window start, oldest stored) and [newest stored - lag, now): the
+                    # trailing lag hours are re-aggregated so AIS rows that arrive late (and the
+                    # partial newest minute) are folded in. Older backfills need --rebuild-hll.
+                    n = conn.execute(text("""
+                    WITH bounds AS (
+                      SELECT MIN(minute_bucket) AS mn, MAX(minute_bucket) AS mx
+                      FROM public.ais_zone_minute_hll
+                      WHERE port_code = :p
                     )
-                  ) AS features
-                FROM public.port_calls_multiport pc
-                LEFT JOIN public.vessel_info vi
-                  ON vi.mmsi::text = pc.mmsi
-                WHERE pc.port_code = :p
-                  AND pc.basin_start_utc IS NOT NULL
-                  AND pc.time_to_berth_hours IS NOT NULL
-                  AND pc.time_to_berth_hours > 0
-                  AND pc.time_to_berth_hours <= :cap
-                  AND pc.basin_start_utc >= (now() AT TIME ZONE 'utc') - (:d || ' days')::interval
-                  AND pc.mmsi ~ '^[0-9]{7,9}$'
-                  -- anti-tug filter ONLY here (ML layer)
-                  AND (vi.vessel_type IS NULL OR vi.vessel_type NOT ILIKE '%tug%')
-                  AND (vi.length_m IS NULL OR vi.length_m >= 70);
-            """), {"p": port, "d": args.since_days, "cap": float(args.cap_hours), "wmin": int(args.window_min)})
-
-            n = conn.execute(text("""
-                SELECT COUNT(*)
-                FROM public.ml_training_samples_multiport
-                WHERE port_code=:p AND label_type='TTB'
-                  AND label_ts_utc >= (now() AT TIME ZONE 'utc') - (:d || ' days')::interval
-            """), {"p": port, "d": args.since_days}).scalar()
-
-            print(f"[TTB] {port}: samples_in_window={n}")
+                    INSERT INTO public.ais_zone_minute_hll (port_code, zone, minute_bucket, mmsi_hll)
+                    SELECT
+                      ap.port_code,
+                      ap.zone,
+                      date_trunc('minute', ap.timestamp_utc),
+                      hll_add_agg(hll_hash_text(ap.mmsi))
+                    FROM public.ais_positions ap, bounds b
+                    WHERE ap.port_code = :p
+                      AND ap.zone IS NOT NULL
+                      AND ap.mmsi ~ '^[0-9]{7,9}$'
+                      AND ap.timestamp_utc >= (now() AT TIME ZONE 'utc') - make_interval(days => :d)
+                                              - GREATEST(interval '6 hours', make_interval(mins => :wmin))
+                      AND (b.mx IS NULL OR ap.timestamp_utc < b.mn
+                           OR ap.timestamp_utc >= b.mx - make_interval(hours => :lag))
+                    GROUP BY 1, 2, 3
+                    ON CONFLICT (port_code, zone, minute_bucket) DO UPDATE SET mmsi_hll = EXCLUDED.mmsi_hll;
+                    """), {"p": port, "d": args.since_days, "wmin": int(args.window_min), "lag": int(args.hll_lag_hours)}).rowcount
+                print(f"[TTB] {port}: ais_zone_minute_hll upserted minutes={n}")
+        congestion_sql = CONGESTION_HLL_SQL
+
+    # Leak-safe features:
+    # - label_ts_utc = pc.basin_start_utc
+    # - congestion uses only AIS points <= label_ts_utc (lookback windows)
+    # vessel_info.mmsi is BIGINT, port_calls_multiport.mmsi is TEXT: join on the stored
+    # bigint mmsi_num so the vessel_info unique index on mmsi is usable (no per-row cast)
+    labels_sql = """
+        WITH pc AS MATERIALIZED (
+          SELECT
+            pc.id,
+            pc.port_code,
+            pc.mmsi,
+            pc.basin_start_utc,
+            pc.time_to_berth_hours
+          FROM public.port_calls_multiport pc
+          LEFT JOIN public.vessel_info vi
+            ON vi.mmsi = pc.mmsi_num
+          WHERE pc.port_code = :p
+            AND pc.basin_start_utc IS NOT NULL
+            AND pc.time_to_berth_hours IS NOT NULL
+            AND pc.time_to_berth_hours > 0
+            AND pc.time_to_berth_hours <= :cap
+            AND pc.basin_start_utc >= :lo
+            AND (:hi IS NULL OR pc.basin_start_utc < :hi)
+            AND pc.mmsi_num IS NOT NULL
+            -- anti-tug filter ONLY here (ML layer); unknown vessels are kept
+            AND (vi.mmsi IS NULL OR vi.ml_eligible)
+        ),
+""" + congestion_sql + """
+        SELECT
+          pc.port_code,
+          pc.mmsi,
+          pc.basin_start_utc AS label_ts_utc,
+          pc.time_to_berth_hours AS label_wait_hours,
+          -- calendar (UTC)
+          EXTRACT(HOUR  FROM (pc.basin_start_utc AT TIME ZONE 'utc'))::int AS hour_utc,
+          EXTRACT(DOW   FROM (pc.basin_start_utc AT TIME ZONE 'utc'))::int AS dow_utc,
+          EXTRACT(MONTH FROM (pc.basin_start_utc AT TIME ZONE 'utc'))::int AS month_utc,
+          COALESCE(c.queue_mmsi_30m, 0)   AS queue_mmsi_30m,
+          COALESCE(c.basin_mmsi_30m, 0)   AS basin_mmsi_30m,
+          COALESCE(c.holding_mmsi_30m, 0) AS holding_mmsi_30m,
+          COALESCE(c.queue_mmsi_6h, 0)    AS queue_mmsi_6h,
+          COALESCE(c.basin_mmsi_6h, 0)    AS basin_mmsi_6h
+        FROM pc
+        LEFT JOIN cong c
+          ON c.id = pc.id
+    """
+
+    workers = args.workers or min(len(ports), os.cpu_count() or 1)
+    jobs = [(port, args, labels_sql) for port in ports]
+    if workers <= 1:
+        for job in jobs:
+            build_port_labels(*job)
+    else:
+        with multiprocessing.Pool(min(workers, len(jobs)), initializer=_init_worker) as pool:
+            pool.starmap(build_port_labels, jobs)
 
     print("=== DONE BUILD TTB LABELS ===")
 
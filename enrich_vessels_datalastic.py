@@ -1,11 +1,16 @@
 #!/usr/bin/env python3
 import os
+import io
+import csv
+import json
 import time
+import random
+import asyncio
+from itertools import islice
 import argparse
 import logging
-import requests
+import aiohttp
 import psycopg2
-from psycopg2.extras import execute_batch
 
 # ---------------- CONFIG ----------------
 
@@ -23,6 +28,11 @@ parser.add_argument("--since-days", type=int, default=365)
 parser.add_argument("--enrich-vessels", action="store_true")
 parser.add_argument("--enrich-limit", type=int, default=0, help="0 = no limit")
 parser.add_argument("--enrich-throttle-rpm", type=int, default=300)
+parser.add_argument("--enrich-concurrency", type=int, default=8, help="Max in-flight Datalastic requests")
+parser.add_argument("--cache-dir", default="cache/datalastic", help="On-disk cache of raw Datalastic responses ({mmsi}.json)")
+parser.add_argument("--refresh-older-than-days", type=float, default=30, help="Refetch cached responses older than this (0 = ignore cache)")
+parser.add_argument("--enrich-retries", type=int, default=4, help="Attempts per MMSI on 429/5xx/timeouts (exponential backoff)")
+parser.add_argument("--enrich-burst", type=int, default=5, help="Token bucket size (requests allowed back to back)")
 args = parser.parse_args()
 
 if not args.enrich_vessels:
@@ -45,12 +55,19 @@ if not API_KEY:
 conn = psycopg2.connect(DATABASE_URL)
 conn.autocommit = False
 cur = conn.cursor()
+# Session-only bulk-load settings: the enrichment is idempotent (re-runnable upsert),
+# so not waiting for the WAL flush on commit is safe; cluster defaults stay untouched.
+cur.execute("SET synchronous_commit = off; SET work_mem = '128MB'; SET temp_buffers = '64MB';")
 
 # ---------------- SELECT MMSIs ----------------
 
 log.info("Selecting missing numeric MMSIs for enrichment...")
 
-cur.execute("""
+# Server-side cursor: MMSIs stream in itersize batches while fetch workers run,
+# instead of materializing the whole set client-side first.
+mmsi_cur = conn.cursor(name="mmsi_stream")
+mmsi_cur.itersize = 10_000
+mmsi_cur.execute("""
     SELECT DISTINCT ap.mmsi::bigint
     FROM public.ais_positions ap
     LEFT JOIN public.vessel_info vi
@@ -60,39 +77,35 @@ cur.execute("""
       AND vi.mmsi IS NULL
 """)
 
-rows = cur.fetchall()
-mmsis = [r[0] for r in rows]
-
-if args.enrich_limit > 0:
-    mmsis = mmsis[:args.enrich_limit]
-
-log.info(f"Found {len(mmsis)} MMSIs to enrich")
-
-if not mmsis:
-    log.info("Nothing to enrich. Done.")
-    exit(0)
-
 # ---------------- ENRICH ----------------
 
 rpm = max(1, args.enrich_throttle_rpm)
-sleep_s = 60.0 / rpm
 
-UPSERT_SQL = """
+VESSEL_COLS = (
+    "mmsi", "imo", "vessel_type", "vessel_type_specific",
+    "deadweight", "gross_tonnage",
+    "length_m", "beam_m",
+    "draught_avg", "draught_max",
+    "year_built", "callsign",
+    "country_iso",
+)
+
+# Payloads are COPYed into a session-private staging table, then merged in one statement
+STAGE_SQL = """
+CREATE TEMP TABLE vessel_info_stg
+  (LIKE public.vessel_info INCLUDING DEFAULTS)
+  ON COMMIT DROP;
+"""
+
+UPSERT_SQL = f"""
 INSERT INTO public.vessel_info (
-    mmsi, imo, vessel_type, vessel_type_specific,
-    deadweight, gross_tonnage,
-    length_m, beam_m,
-    draught_avg, draught_max,
-    year_built, callsign,
-    country_iso, source, last_updated
-) VALUES (
-    %(mmsi)s, %(imo)s, %(vessel_type)s, %(vessel_type_specific)s,
-    %(deadweight)s, %(gross_tonnage)s,
-    %(length_m)s, %(beam_m)s,
-    %(draught_avg)s, %(draught_max)s,
-    %(year_built)s, %(callsign)s,
-    %(country_iso)s, 'datalastic', now()
+    {", ".join(VESSEL_COLS)},
+    source, last_updated
 )
+SELECT
+    {", ".join(VESSEL_COLS)},
+    'datalastic', now()
+FROM vessel_info_stg
 ON CONFLICT (mmsi) DO UPDATE SET
     imo = EXCLUDED.imo,
     vessel_type = EXCLUDED.vessel_type,
@@ -109,50 +122,187 @@ ON CONFLICT (mmsi) DO UPDATE SET
     last_updated = now();
 """
 
-payloads = []
+class RateLimiter:
+    """Token bucket: RATE tokens/s refill, at most MAX_TOKENS banked."""
+
+    def __init__(self, rpm, burst):
+        self.RATE = rpm / 60.0
+        self.MAX_TOKENS = max(1, burst)
+        self.tokens = self.MAX_TOKENS
+        self.updated_at = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def wait_for_token(self):
+        # Waiters queue on the lock, so tokens are handed out in arrival order
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.MAX_TOKENS, self.tokens + (now - self.updated_at) * self.RATE)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.RATE)
+
+
+def to_payload(mmsi, data):
+    return {
+        "mmsi": int(mmsi),
+        "imo": data.get("imo"),
+        "vessel_type": data.get("type"),
+        "vessel_type_specific": data.get("type_specific"),
+        "deadweight": data.get("deadweight"),
+        "gross_tonnage": data.get("gross_tonnage"),
+        "length_m": data.get("length"),
+        "beam_m": data.get("breadth"),
+        "draught_avg": data.get("draught_avg"),
+        "draught_max": data.get("draught_max"),
+        "year_built": data.get("year_built"),
+        "callsign": data.get("callsign"),
+        "country_iso": data.get("country_iso"),
+    }
+
+
+def cache_path(mmsi):
+    return os.path.join(args.cache_dir, f"{mmsi}.json")
+
+
+def read_cache(mmsi):
+    """Cached raw response body, or None if missing, stale or unreadable."""
+    if args.refresh_older_than_days <= 0:
+        return None
+    path = cache_path(mmsi)
+    try:
+        if time.time() - os.path.getmtime(path) > args.refresh_older_than_days * 86400:
+            return None
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
 
-for i, mmsi in enumerate(mmsis, 1):
-    log.info(f"[{i}/{len(mmsis)}] Fetching MMSI {mmsi}")
 
+def write_cache(mmsi, body):
+    # Write-then-rename so an interrupted run never leaves a truncated entry
+    tmp = cache_path(mmsi) + ".tmp"
     try:
-        r = requests.get(
-            DATALASTIC_URL,
-            params={"api-key": API_KEY, "mmsi": mmsi},
-            timeout=30
-        )
-        r.raise_for_status()
-        data = r.json().get("data")
-
-        if not data:
-            log.warning(f"No data for MMSI {mmsi}")
-            continue
-
-        payloads.append({
-            "mmsi": int(mmsi),
-            "imo": data.get("imo"),
-            "vessel_type": data.get("type"),
-            "vessel_type_specific": data.get("type_specific"),
-            "deadweight": data.get("deadweight"),
-            "gross_tonnage": data.get("gross_tonnage"),
-            "length_m": data.get("length"),
-            "beam_m": data.get("breadth"),
-            "draught_avg": data.get("draught_avg"),
-            "draught_max": data.get("draught_max"),
-            "year_built": data.get("year_built"),
-            "callsign": data.get("callsign"),
-            "country_iso": data.get("country_iso"),
-        })
-
+        os.makedirs(args.cache_dir, exist_ok=True)
+        with open(tmp, "w") as f:
+            json.dump(body, f)
+        os.replace(tmp, cache_path(mmsi))
+    except OSError as e:
+        log.warning(f"MMSI {mmsi} not cached: {e}")
+
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+def backoff_s(attempt, retry_after=None):
+    # Honour Retry-After (seconds form) when the API sends it, else 2^n + jitter, capped
+    if retry_after and retry_after.isdigit():
+        return min(float(retry_after), 60.0)
+    return min(2 ** attempt + random.random(), 30.0)
+
+
+async def fetch_with_retry(session, limiter, mmsi):
+    """Raw response body; retries transient failures only (404/4xx raise immediately)."""
+    attempts = max(1, args.enrich_retries)
+    for attempt in range(attempts):
+        # Every attempt is a real API call, so each one takes a token
+        await limiter.wait_for_token()
+        last = attempt == attempts - 1
+        try:
+            async with session.get(DATALASTIC_URL, params={"api-key": API_KEY, "mmsi": str(mmsi)}) as r:
+                if r.status in RETRY_STATUSES and not last:
+                    delay = backoff_s(attempt, r.headers.get("Retry-After"))
+                    log.warning(f"MMSI {mmsi} HTTP {r.status}, retry {attempt + 1} in {delay:.1f}s")
+                    await asyncio.sleep(delay)
+                    continue
+                r.raise_for_status()
+                return await r.json()
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+            if last:
+                raise
+            delay = backoff_s(attempt)
+            log.warning(f"MMSI {mmsi} {type(e).__name__}, retry {attempt + 1} in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+
+async def fetch(session, limiter, i, mmsi):
+    # Cache hits (files are tiny; plain reads) spend no rate budget
+    body = read_cache(mmsi)
+    cached = body is not None
+    if cached:
+        log.info(f"[{i}] MMSI {mmsi} from cache")
+    else:
+        log.info(f"[{i}] Fetching MMSI {mmsi}")
+
+    # Fetch and parse both stay inside the per-MMSI try: one malformed response must not
+    # kill the worker (and with it the whole run's payloads)
+    try:
+        if not cached:
+            body = await fetch_with_retry(session, limiter, mmsi)
+        data = body.get("data")
+        payload = to_payload(mmsi, data) if data else None
     except Exception as e:
         log.error(f"MMSI {mmsi} failed: {e}")
-
-    time.sleep(sleep_s)
+        return None
+
+    # Only well-formed responses are cached, so a bad body is re-fetched next run
+    if not cached:
+        write_cache(mmsi, body)
+    if payload is None:
+        log.warning(f"No data for MMSI {mmsi}")
+    return payload
+
+
+async def fetch_all():
+    # --enrich-concurrency workers drain a bounded queue fed from the MMSI cursor;
+    # pacing to the RPM budget comes from the limiter
+    n_workers = max(1, args.enrich_concurrency)
+    limiter = RateLimiter(rpm, args.enrich_burst)
+    queue = asyncio.Queue(maxsize=n_workers * 4)
+    payloads = []
+    seen = 0
+
+    async def worker(session):
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            p = await fetch(session, limiter, *item)
+            if p:
+                payloads.append(p)
+
+    connector = aiohttp.TCPConnector(limit=32, keepalive_timeout=60)
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=30)) as session:
+        workers = [asyncio.create_task(worker(session)) for _ in range(n_workers)]
+        for seen, (mmsi,) in enumerate(islice(mmsi_cur, args.enrich_limit or None), 1):
+            await queue.put((seen, mmsi))
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers)
+    return seen, payloads
+
+
+n_mmsis, payloads = asyncio.run(fetch_all())
+mmsi_cur.close()
+log.info(f"Processed {n_mmsis} MMSIs to enrich")
+
+if not n_mmsis:
+    log.info("Nothing to enrich. Done.")
+    exit(0)
 
 # ---------------- UPSERT ----------------
 
 if payloads:
     log.info(f"Upserting {len(payloads)} vessels into vessel_info")
-    execute_batch(cur, UPSERT_SQL, payloads, page_size=50)
+    # CSV: unquoted empty field = NULL (csv.writer writes None as empty)
+    buf = io.StringIO()
+    csv.writer(buf).writerows([p[c] for c in VESSEL_COLS] for p in payloads)
+    buf.seek(0)
+    cur.execute(STAGE_SQL)
+    cur.copy_expert(f"COPY vessel_info_stg ({', '.join(VESSEL_COLS)}) FROM STDIN WITH (FORMAT csv)", buf)
+    cur.execute(UPSERT_SQL)
     conn.commit()
 else:
     log.warning("No vessels enriched")
@@ -0,0 +1,16 @@
+-- One covering index for the per-port AIS window scans of the ML batch scripts:
+--   build_time_to_berth_labels.py    congestion ap_join  (port_code, timestamp_utc range; zone, mmsi)
+--   ml/build_ttb_training_multiport.py  ais_win          (port_code, timestamp_utc range; zone, mmsi, sog)
+-- Created once here instead of as a side effect of the batch scripts. zone/mmsi filters are
+-- checked on the INCLUDE columns, so both scans stay index-only.
+--
+-- CONCURRENTLY cannot run inside a transaction block: run with plain psql (no -1 / --single-transaction):
+--   psql "$DATABASE_URL" -f migrations/001_ais_positions_port_time_cover.sql
+--
+-- Same leading keys as the existing idx_ais_pos_port_time; once this is valid that index is
+-- redundant and can be dropped separately after checking other consumers.
+
+SET statement_timeout = 0;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_ais_pos_port_time_cover
+  ON public.ais_positions (port_code, timestamp_utc) INCLUDE (zone, mmsi, sog);
@@ -2,8 +2,12 @@
 import os
 import sys
 import argparse
+import multiprocessing
 import psycopg2
 
+# One connection per process, reused for every port that process builds
+_conn = None
+
 def get_cols(cur, table_name: str):
     cur.execute("""
         SELECT column_name
@@ -16,11 +20,98 @@ def get_cols(cur, table_name: str):
 def colset(cols):
     return set([c.lower() for c in cols])
 
+def open_belts_conn(db):
+    """Connect and apply the bulk-load session settings once per process."""
+    global _conn
+    _conn = psycopg2.connect(db)
+    _conn.autocommit = False
+    cur = _conn.cursor()
+    # Session-only bulk-load settings (belts are rebuilt idempotently; no fsync wait per
+    # commit). temp_buffers must be set before the first temp table (tmp_belts) is touched.
+    cur.execute("SET synchronous_commit = off; SET work_mem = '128MB'; SET temp_buffers = '64MB';")
+    _conn.commit()
+    cur.close()
+
+def build_port(port, args, col_list, select_list, stage_select_list, land_sql):
+    """One port end to end on the process connection (ports share no rows)."""
+    conn = _conn
+    cur = conn.cursor()
+
+    print(f"\n[BELTS] port={port}")
+
+    # Decide source preference: refined if exists else inferred
+    cur.execute("""
+        SELECT COUNT(*)
+        FROM berth_polygons
+        WHERE port_code=%s AND source='ais_refined'
+    """, (port,))
+    refined_count = cur.fetchone()[0]
+
+    if refined_count > 0:
+        src = "ais_refined"
+        print(f"  using source={src} (count={refined_count})")
+        berth_where = "port_code=%(port)s AND source='ais_refined'"
+    else:
+        src = "ais_inferred"
+        print("  no refined berths found; falling back to ais_inferred with area<=0.5 km² filter")
+        berth_where = "port_code=%(port)s AND source='ais_inferred' AND ST_Area(geom::geography)/1e6 <= 0.5"
+
+    if args.replace:
+        cur.execute("DELETE FROM berth_belts_multiport WHERE port_code=%s", (port,))
+        conn.commit()
+        print("  cleared existing belts")
+
+    conf = 0.90 if src == "ais_refined" else 0.50
+    params = {"port": port, "buffer_m": float(args.buffer_m), "conf": float(conf)}
+
+    cur.execute(f"SELECT COUNT(*) FROM berth_polygons WHERE {berth_where}", params)
+    n_berths = cur.fetchone()[0]
+    print(f"  berth_polygons selected={n_berths}")
+    if n_berths == 0:
+        cur.close()
+        return
+
+    if n_berths <= args.stage_threshold:
+        sql = f"""
+            INSERT INTO berth_belts_multiport ({col_list})
+            SELECT {select_list}
+            FROM berth_polygons
+            WHERE {berth_where}
+            ORDER BY berth_id
+            ON CONFLICT DO NOTHING
+        """
+        cur.execute(sql, params)
+        created = cur.rowcount
+    else:
+        # Large refined sets: buffer once into an unlogged session temp table, then land it
+        # in bounded batches so no single statement/transaction carries the whole port.
+        cur.execute("DROP TABLE IF EXISTS tmp_belts")
+        cur.execute(f"""
+            CREATE TEMP TABLE tmp_belts AS
+            SELECT
+              ROW_NUMBER() OVER (ORDER BY berth_id) AS rn,
+              {stage_select_list}
+            FROM berth_polygons
+            WHERE {berth_where}
+        """, params)
+        created = 0
+        for lo in range(0, n_berths, args.stage_threshold):
+            cur.execute(land_sql, (lo, lo + args.stage_threshold))
+            created += cur.rowcount
+            conn.commit()
+        cur.execute("DROP TABLE tmp_belts")
+
+    conn.commit()
+    print(f"  [OK] created={created} belts (source={src})")
+    cur.close()
+
 def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("--ports", required=True, help="Comma-separated ports e.g. STS,PNG")
     ap.add_argument("--buffer-m", type=float, default=60.0, help="Buffer meters around berth polygon to create belt geom")
     ap.add_argument("--replace", action="store_true", help="Delete existing belts for port before inserting")
+    ap.add_argument("--workers", type=int, default=0, help="Parallel ports, one connection each (0 = min(ports, CPUs))")
+    ap.add_argument("--stage-threshold", type=int, default=5000, help="Ports with more berths than this stage belts in a temp table and insert in batches of this size")
     args = ap.parse_args()
 
     db = os.getenv("DATABASE_URL")
@@ -37,11 +128,11 @@ def main():
     print(f"Ports={ports} buffer_m={args.buffer_m} replace={args.replace}")
 
     conn = psycopg2.connect(db)
-    conn.autocommit = False
     cur = conn.cursor()
-
     belts_cols = get_cols(cur, "berth_belts_multiport")
     berths_cols = get_cols(cur, "berth_polygons")
+    cur.close()
+    conn.close()
     if not belts_cols:
         raise SystemExit("ERROR: berth_belts_multiport not found in public schema")
     if not berths_cols:
@@ -63,119 +154,44 @@ def main():
     if "port_code" not in belts or "belt_id" not in belts or "geom" not in belts:
         raise SystemExit("ERROR: berth_belts_multiport must have at least (port_code, belt_id, geom)")
 
-    def insert_belt(row):
-        """
-        row dict contains possible keys matching writable columns.
-        Build INSERT dynamically.
-        """
-        cols = [c for c in writable if c in row]
-        placeholders = [f"%({c})s" for c in cols]
-        sql = f"INSERT INTO berth_belts_multiport ({', '.join(cols)}) VALUES ({', '.join(placeholders)})"
-        # Try safe upsert if unique exists; otherwise just DO NOTHING
-        # Most installs have UNIQUE(port_code, belt_id)
-        sql += " ON CONFLICT DO NOTHING"
-        cur.execute(sql, row)
-
-    for port in ports:
-        print(f"\n[BELTS] port={port}")
-
-        # Decide source preference: refined if exists else inferred
-        cur.execute("""
-            SELECT COUNT(*)
-            FROM berth_polygons
-            WHERE port_code=%s AND source='ais_refined'
-        """, (port,))
-        refined_count = cur.fetchone()[0]
-
-        if refined_count > 0:
-            src = "ais_refined"
-            print(f"  using source={src} (count={refined_count})")
-            berth_where = "port_code=%s AND source='ais_refined'"
-            params = (port,)
-        else:
-            src = "ais_inferred"
-            print("  no refined berths found; falling back to ais_inferred with area<=0.5 km² filter")
-            berth_where = "port_code=%s AND source='ais_inferred' AND ST_Area(geom::geography)/1e6 <= 0.5"
-            params = (port,)
-
-        if args.replace:
-            cur.execute("DELETE FROM berth_belts_multiport WHERE port_code=%s", (port,))
-            conn.commit()
-            print("  cleared existing belts")
-
-        # Fetch berth polygons + centroid for optional fields
-        cur.execute(f"""
-            SELECT
-              berth_id,
-              ST_AsText(geom) as wkt,
-              ST_Y(ST_Centroid(geom)) AS cy,
-              ST_X(ST_Centroid(geom)) AS cx
-            FROM berth_polygons
-            WHERE {berth_where}
-            ORDER BY berth_id
-        """, params)
-        berths = cur.fetchall()
-
-        print(f"  berth_polygons selected={len(berths)}")
-        if len(berths) == 0:
-            continue
-
-        created = 0
-        for berth_id, wkt, cy, cx in berths:
-            belt_id = berth_id.replace("BERTH", "BELT") if "BERTH" in berth_id else f"{berth_id}_BELT"
-
-            # Build belt geom from berth polygon buffer
-            # We pass WKT to PostGIS to avoid psycopg2 geometry adapters.
-            cur.execute("""
-                SELECT ST_AsGeoJSON(
-                    ST_Buffer(
-                        ST_GeomFromText(%s, 4326)::geography,
-                        %s
-                    )::geometry
-                )
-            """, (wkt, args.buffer_m))
-            belt_geojson = cur.fetchone()[0]
-
-            conf = 0.90 if src == "ais_refined" else 0.50
-
-            row = {
-                "port_code": port,
-                "belt_id": belt_id,
-                "geom": belt_geojson,
-            }
-            # Optional columns if exist
-            if "berth_id" in belts:
-                row["berth_id"] = berth_id
-            if "radius_m" in belts:
-                row["radius_m"] = float(args.buffer_m)
-            if "confidence" in belts:
-                row["confidence"] = float(conf)
-            if "center_lat" in belts:
-                row["center_lat"] = float(cy) if cy is not None else None
-            if "center_lon" in belts:
-                row["center_lon"] = float(cx) if cx is not None else None
-
-            # Insert using GeoJSON -> geometry in SQL if geom column expects geometry
-            # If geom is geometry type, inserting GeoJSON string directly may fail.
-            # So we convert inside SQL using ST_GeomFromGeoJSON when geom column exists.
-            if "geom" in row:
-                # We rewrite the insert to cast geom properly:
-                cols = [c for c in writable if c in row and c != "geom"]
-                cols_with_geom = cols + ["geom"]
-                placeholders = [f"%({c})s" for c in cols] + ["ST_SetSRID(ST_GeomFromGeoJSON(%(geom)s),4326)"]
-
-                sql = f"INSERT INTO berth_belts_multiport ({', '.join(cols_with_geom)}) VALUES ({', '.join(placeholders)}) ON CONFLICT DO NOTHING"
-                cur.execute(sql, row)
-            else:
-                insert_belt(row)
-
-            created += 1
-
-        conn.commit()
-        print(f"  [OK] created/attempted={created} belts (source={src})")
-
-    cur.close()
-    conn.close()
+    # One set-based INSERT ... SELECT per port: belts are buffered server-side,
+    # geometry never leaves PostGIS (no WKT/GeoJSON round-trip per berth).
+    # The column set is fixed for the run, so the SQL pieces are built once here;
+    # only the berth filter varies per port.
+    exprs = {
+        "port_code": "port_code",
+        "belt_id": "CASE WHEN berth_id LIKE '%%BERTH%%' THEN replace(berth_id, 'BERTH', 'BELT') ELSE berth_id || '_BELT' END",
+        "berth_id": "berth_id",
+        "radius_m": "%(buffer_m)s::double precision",
+        "confidence": "%(conf)s::double precision",
+        "geom": "ST_Buffer(geom::geography, %(buffer_m)s)::geometry",
+        "center_lat": "ST_Y(ST_Centroid(geom))",
+        "center_lon": "ST_X(ST_Centroid(geom))",
+    }
+    cols = [c for c in writable if c in exprs]
+    col_list = ", ".join(cols)
+    select_list = ", ".join(exprs[c] for c in cols)
+    stage_select_list = ", ".join(f"{exprs[c]} AS {c}" for c in cols)
+    land_sql = f"""
+        INSERT INTO berth_belts_multiport ({col_list})
+        SELECT {col_list}
+        FROM tmp_belts
+        WHERE rn > %s AND rn <= %s
+        ORDER BY rn
+        ON CONFLICT DO NOTHING
+    """
+
+    workers = args.workers or min(len(ports), os.cpu_count() or 1)
+    jobs = [(port, args, col_list, select_list, stage_select_list, land_sql) for port in ports]
+    if workers <= 1:
+        open_belts_conn(db)
+        for job in jobs:
+            build_port(*job)
+        _conn.close()
+    else:
+        with multiprocessing.Pool(min(workers, len(jobs)), initializer=open_belts_conn,
+                                  initargs=(db,)) as pool:
+            pool.starmap(build_port, jobs)
     print("\n=== DONE BUILD BERTH BELTS MULTIPORT ===")
 
 if __name__ == "__main__":
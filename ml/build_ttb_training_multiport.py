@@ -28,8 +28,78 @@ import os
 import argparse
 from sqlalchemy import create_engine, text
 
-UPSERT_SQL = """
-WITH lbl AS (
+# 6h/24h distinct-MMSI counts. 30m/2h stay exact (small sets, where HLL error matters most).
+WIDE_DISTINCT_EXACT_SQL = """
+    COUNT(DISTINCT mmsi) FILTER (WHERE zone = 'ANCHORAGE' AND timestamp_utc > anchorage_start_utc - interval '6 hours')::bigint   AS q_anch_6h,
+    COUNT(DISTINCT mmsi) FILTER (WHERE zone = 'ANCHORAGE')::bigint                                                                 AS q_anch_24h,
+    COUNT(DISTINCT mmsi) FILTER (WHERE zone = 'APPROACH'  AND timestamp_utc > anchorage_start_utc - interval '6 hours')::bigint   AS q_app_6h,
+    COUNT(DISTINCT mmsi) FILTER (WHERE zone = 'PORT_AREA' AND timestamp_utc > anchorage_start_utc - interval '6 hours')::bigint   AS q_portarea_6h,
+"""
+
+# --approx-distinct: HyperLogLog sketches (hll extension) instead of hashing/sorting exact sets
+WIDE_DISTINCT_HLL_SQL = """
+    hll_cardinality(hll_add_agg(hll_hash_text(mmsi)) FILTER (WHERE zone = 'ANCHORAGE' AND timestamp_utc > anchorage_start_utc - interval '6 hours'))::bigint AS q_anch_6h,
+    hll_cardinality(hll_add_agg(hll_hash_text(mmsi)) FILTER (WHERE zone = 'ANCHORAGE'))::bigint                                                               AS q_anch_24h,
+    hll_cardinality(hll_add_agg(hll_hash_text(mmsi)) FILTER (WHERE zone = 'APPROACH'  AND timestamp_utc > anchorage_start_utc - interval '6 hours'))::bigint AS q_app_6h,
+    hll_cardinality(hll_add_agg(hll_hash_text(mmsi)) FILTER (WHERE zone = 'PORT_AREA' AND timestamp_utc > anchorage_start_utc - interval '6 hours'))::bigint AS q_portarea_6h,
+"""
+
+# Rolling port medians from PAST labels: one scan of the widest (90d) window, split by FILTER
+PORT_MEDIANS_LATERAL_SQL = """
+  LEFT JOIN LATERAL (
+    SELECT
+      percentile_cont(0.5) WITHIN GROUP (ORDER BY t.time_to_berth_hours)
+        FILTER (WHERE t.anchorage_start_utc >= l.anchorage_start_utc - interval '7 days')::double precision  AS port_median_ttb_7d,
+      percentile_cont(0.5) WITHIN GROUP (ORDER BY t.time_to_berth_hours)
+        FILTER (WHERE t.anchorage_start_utc >= l.anchorage_start_utc - interval '30 days')::double precision AS port_median_ttb_30d,
+      percentile_cont(0.5) WITHIN GROUP (ORDER BY t.time_to_berth_hours)::double precision                  AS port_median_ttb_90d
+    FROM public.time_to_berth_labels t
+    WHERE t.port_code = l.port_code
+      AND t.anchorage_start_utc <  l.anchorage_start_utc
+      AND t.anchorage_start_utc >= l.anchorage_start_utc - interval '90 days'
+  ) pm ON true
+"""
+
+# --medians-mv: medians precomputed per (port_code, label hour) over labels strictly before
+# that hour (leak-safe; ignores same-hour earlier labels). Reused across runs; a hash join here.
+PORT_MEDIANS_MV_DDL = """
+CREATE MATERIALIZED VIEW IF NOT EXISTS public.mv_port_median_ttb AS
+WITH b AS (
+  SELECT DISTINCT port_code, date_trunc('hour', anchorage_start_utc) AS h
+  FROM public.time_to_berth_labels
+)
+SELECT
+  b.port_code,
+  b.h,
+  pm.port_median_ttb_7d,
+  pm.port_median_ttb_30d,
+  pm.port_median_ttb_90d
+FROM b
+LEFT JOIN LATERAL (
+  SELECT
+    percentile_cont(0.5) WITHIN GROUP (ORDER BY t.time_to_berth_hours)
+      FILTER (WHERE t.anchorage_start_utc >= b.h - interval '7 days')::double precision  AS port_median_ttb_7d,
+    percentile_cont(0.5) WITHIN GROUP (ORDER BY t.time_to_berth_hours)
+      FILTER (WHERE t.anchorage_start_utc >= b.h - interval '30 days')::double precision AS port_median_ttb_30d,
+    percentile_cont(0.5) WITHIN GROUP (ORDER BY t.time_to_berth_hours)::double precision AS port_median_ttb_90d
+  FROM public.time_to_berth_labels t
+  WHERE t.port_code = b.port_code
+    AND t.anchorage_start_utc <  b.h
+    AND t.anchorage_start_utc >= b.h - interval '90 days'
+) pm ON true;
+"""
+
+PORT_MEDIANS_MV_SQL = """
+  LEFT JOIN public.mv_port_median_ttb pm
+    ON pm.port_code = l.port_code
+   AND pm.h = date_trunc('hour', l.anchorage_start_utc)
+"""
+
+# Features are computed once into a session-private staging table (ANALYZEd, so the
+# merge below plans on real row counts) instead of feeding UPDATE and INSERT CTEs.
+FEAT_STAGE_SQL = """
+CREATE TEMP TABLE stg_ttb ON COMMIT DROP AS
+WITH lbl AS MATERIALIZED (
   SELECT
     port_call_id,
     port_code,
@@ -43,6 +113,41 @@ WITH lbl AS (
     AND (:port_code IS NULL OR port_code = :port_code)
 ),
 
+/* one index range scan per label over the widest (24h) window: zone pings for
+   congestion plus the vessel's own pings for motion (a subset of the same range) */
+ais_win AS MATERIALIZED (
+  SELECT
+    l.port_call_id,
+    ap.mmsi,
+    ap.zone,
+    ap.sog,
+    ap.timestamp_utc,
+    l.anchorage_start_utc,
+    (ap.mmsi = l.mmsi) AS is_self
+  FROM lbl l
+  JOIN public.ais_positions ap
+    ON ap.port_code = l.port_code
+   AND ap.timestamp_utc >  l.anchorage_start_utc - interval '24 hours'
+   AND ap.timestamp_utc <= l.anchorage_start_utc
+  WHERE ap.zone IN ('ANCHORAGE', 'APPROACH', 'PORT_AREA')
+     OR ap.mmsi = l.mmsi
+),
+
+win_agg AS (
+  SELECT
+    port_call_id,
+    COUNT(DISTINCT mmsi) FILTER (WHERE zone = 'ANCHORAGE' AND timestamp_utc > anchorage_start_utc - interval '30 minutes')::bigint AS q_anch_30m,
+    COUNT(DISTINCT mmsi) FILTER (WHERE zone = 'ANCHORAGE' AND timestamp_utc > anchorage_start_utc - interval '2 hours')::bigint   AS q_anch_2h,
+    /*WIDE_DISTINCT*/
+    AVG(sog) FILTER (WHERE is_self AND sog IS NOT NULL AND timestamp_utc > anchorage_start_utc - interval '1 hour')::double precision  AS sog_mean_1h,
+    AVG(sog) FILTER (WHERE is_self AND sog IS NOT NULL AND timestamp_utc > anchorage_start_utc - interval '6 hours')::double precision AS sog_mean_6h,
+    AVG(sog) FILTER (WHERE is_self AND sog IS NOT NULL)::double precision                                                              AS sog_mean_24h,
+    (COUNT(*) FILTER (WHERE is_self AND sog < 0.5 AND timestamp_utc > anchorage_start_utc - interval '6 hours'))::double precision
+      / NULLIF(COUNT(*) FILTER (WHERE is_self AND sog IS NOT NULL AND timestamp_utc > anchorage_start_utc - interval '6 hours'), 0) AS stopped_share_6h
+  FROM ais_win
+  GROUP BY port_call_id
+),
+
 feat AS (
   SELECT
     l.port_code,
@@ -60,90 +165,18 @@ feat AS (
         'month',      EXTRACT(MONTH FROM l.anchorage_start_utc AT TIME ZONE 'utc')::int,
 
         /* -------- congestion snapshots (distinct MMSI) -------- */
-        'q_anch_30m', COALESCE((
-          SELECT COUNT(DISTINCT ap.mmsi)::bigint
-          FROM public.ais_positions ap
-          WHERE ap.port_code = l.port_code
-            AND ap.timestamp_utc >  l.anchorage_start_utc - interval '30 minutes'
-            AND ap.timestamp_utc <= l.anchorage_start_utc
-            AND ap.zone = 'ANCHORAGE'
-        ),0),
-
-        'q_anch_2h', COALESCE((
-          SELECT COUNT(DISTINCT ap.mmsi)::bigint
-          FROM public.ais_positions ap
-          WHERE ap.port_code = l.port_code
-            AND ap.timestamp_utc >  l.anchorage_start_utc - interval '2 hours'
-            AND ap.timestamp_utc <= l.anchorage_start_utc
-            AND ap.zone = 'ANCHORAGE'
-        ),0),
-
-        'q_anch_6h', COALESCE((
-          SELECT COUNT(DISTINCT ap.mmsi)::bigint
-          FROM public.ais_positions ap
-          WHERE ap.port_code = l.port_code
-            AND ap.timestamp_utc >  l.anchorage_start_utc - interval '6 hours'
-            AND ap.timestamp_utc <= l.anchorage_start_utc
-            AND ap.zone = 'ANCHORAGE'
-        ),0),
-
-        'q_anch_24h', COALESCE((
-          SELECT COUNT(DISTINCT ap.mmsi)::bigint
-          FROM public.ais_positions ap
-          WHERE ap.port_code = l.port_code
-            AND ap.timestamp_utc >  l.anchorage_start_utc - interval '24 hours'
-            AND ap.timestamp_utc <= l.anchorage_start_utc
-            AND ap.zone = 'ANCHORAGE'
-        ),0),
-
-        'q_app_6h', COALESCE((
-          SELECT COUNT(DISTINCT ap.mmsi)::bigint
-          FROM public.ais_positions ap
-          WHERE ap.port_code = l.port_code
-            AND ap.timestamp_utc >  l.anchorage_start_utc - interval '6 hours'
-            AND ap.timestamp_utc <= l.anchorage_start_utc
-            AND ap.zone = 'APPROACH'
-        ),0),
-
-        'q_portarea_6h', COALESCE((
-          SELECT COUNT(DISTINCT ap.mmsi)::bigint
-          FROM public.ais_positions ap
-          WHERE ap.port_code = l.port_code
-            AND ap.timestamp_utc >  l.anchorage_start_utc - interval '6 hours'
-            AND ap.timestamp_utc <= l.anchorage_start_utc
-            AND ap.zone = 'PORT_AREA'
-        ),0),
+        'q_anch_30m', COALESCE(w.q_anch_30m, 0),
+        'q_anch_2h', COALESCE(w.q_anch_2h, 0),
+        'q_anch_6h', COALESCE(w.q_anch_6h, 0),
+        'q_anch_24h', COALESCE(w.q_anch_24h, 0),
+        'q_app_6h', COALESCE(w.q_app_6h, 0),
+        'q_portarea_6h', COALESCE(w.q_portarea_6h, 0),
 
         /* -------- queue trend proxy: last30m vs avg per-hour last6h -------- */
-        'q_trend_30m_minus_6h_rate', (
-          COALESCE((
-            SELECT COUNT(DISTINCT ap.mmsi)::double precision
-            FROM public.ais_positions ap
-            WHERE ap.port_code = l.port_code
-              AND ap.timestamp_utc >  l.anchorage_start_utc - interval '30 minutes'
-              AND ap.timestamp_utc <= l.anchorage_start_utc
-              AND ap.zone = 'ANCHORAGE'
-          ),0)
-          -
-          COALESCE((
-            SELECT (COUNT(DISTINCT ap.mmsi)::double precision / 6.0)
-            FROM public.ais_positions ap
-            WHERE ap.port_code = l.port_code
-              AND ap.timestamp_utc >  l.anchorage_start_utc - interval '6 hours'
-              AND ap.timestamp_utc <= l.anchorage_start_utc
-              AND ap.zone = 'ANCHORAGE'
-          ),0)
-        ),
+        'q_trend_30m_minus_6h_rate', COALESCE(w.q_anch_30m::double precision - (w.q_anch_6h::double precision / 6.0), 0),
 
         /* -------- arrival rate proxy into anchorage (distinct MMSI seen in anchorage last 24h) -------- */
-        'anch_arrivals_24h_distinct', COALESCE((
-          SELECT COUNT(DISTINCT ap.mmsi)::bigint
-          FROM public.ais_positions ap
-          WHERE ap.port_code = l.port_code
-            AND ap.timestamp_utc >  l.anchorage_start_utc - interval '24 hours'
-            AND ap.timestamp_utc <= l.anchorage_start_utc
-            AND ap.zone = 'ANCHORAGE'
-        ),0),
+        'anch_arrivals_24h_distinct', COALESCE(w.q_anch_24h, 0),
 
         /* -------- throughput proxy: AIS berth_calls ended in last 72h (PAST ONLY) -------- */
         'berth_throughput_72h', COALESCE((
@@ -156,27 +189,9 @@ feat AS (
         ),0),
 
         /* -------- rolling port medians from PAST labels only -------- */
-        'port_median_ttb_7d', (
-          SELECT percentile_cont(0.5) WITHIN GROUP (ORDER BY t.time_to_berth_hours)::double precision
-          FROM public.time_to_berth_labels t
-          WHERE t.port_code = l.port_code
-            AND t.anchorage_start_utc <  l.anchorage_start_utc
-            AND t.anchorage_start_utc >= l.anchorage_start_utc - interval '7 days'
-        ),
-        'port_median_ttb_30d', (
-          SELECT percentile_cont(0.5) WITHIN GROUP (ORDER BY t.time_to_berth_hours)::double precision
-          FROM public.time_to_berth_labels t
-          WHERE t.port_code = l.port_code
-            AND t.anchorage_start_utc <  l.anchorage_start_utc
-            AND t.anchorage_start_utc >= l.anchorage_start_utc - interval '30 days'
-        ),
-        'port_median_ttb_90d', (
-          SELECT percentile_cont(0.5) WITHIN GROUP (ORDER BY t.time_to_berth_hours)::double precision
-          FROM public.time_to_berth_labels t
-          WHERE t.port_code = l.port_code
-            AND t.anchorage_start_utc <  l.anchorage_start_utc
-            AND t.anchorage_start_utc >= l.anchorage_start_utc - interval '90 days'
-        ),
+        'port_median_ttb_7d', pm.port_median_ttb_7d,
+        'port_median_ttb_30d', pm.port_median_ttb_30d,
+        'port_median_ttb_90d', pm.port_median_ttb_90d,
 
         /* -------- vessel+port history (PAST ONLY) -------- */
         'vessel_port_prev_count_365d', COALESCE((
@@ -212,45 +227,10 @@ feat AS (
         ),
 
         /* -------- vessel motion windows (PAST ONLY) -------- */
-        'sog_mean_1h', (
-          SELECT AVG(ap.sog)::double precision
-          FROM public.ais_positions ap
-          WHERE ap.port_code = l.port_code
-            AND ap.mmsi = l.mmsi
-            AND ap.timestamp_utc >  l.anchorage_start_utc - interval '1 hour'
-            AND ap.timestamp_utc <= l.anchorage_start_utc
-            AND ap.sog IS NOT NULL
-        ),
-        'sog_mean_6h', (
-          SELECT AVG(ap.sog)::double precision
-          FROM public.ais_positions ap
-          WHERE ap.port_code = l.port_code
-            AND ap.mmsi = l.mmsi
-            AND ap.timestamp_utc >  l.anchorage_start_utc - interval '6 hours'
-            AND ap.timestamp_utc <= l.anchorage_start_utc
-            AND ap.sog IS NOT NULL
-        ),
-        'sog_mean_24h', (
-          SELECT AVG(ap.sog)::double precision
-          FROM public.ais_positions ap
-          WHERE ap.port_code = l.port_code
-            AND ap.mmsi = l.mmsi
-            AND ap.timestamp_utc >  l.anchorage_start_utc - interval '24 hours'
-            AND ap.timestamp_utc <= l.anchorage_start_utc
-            AND ap.sog IS NOT NULL
-        ),
-
-        'stopped_share_6h', (
-          SELECT CASE WHEN COUNT(*) = 0 THEN NULL
-                      ELSE (SUM(CASE WHEN ap.sog < 0.5 THEN 1 ELSE 0 END)::double precision / COUNT(*)::double precision)
-                 END
-          FROM public.ais_positions ap
-          WHERE ap.port_code = l.port_code
-            AND ap.mmsi = l.mmsi
-            AND ap.timestamp_utc >  l.anchorage_start_utc - interval '6 hours'
-            AND ap.timestamp_utc <= l.anchorage_start_utc
-            AND ap.sog IS NOT NULL
-        ),
+        'sog_mean_1h', w.sog_mean_1h,
+        'sog_mean_6h', w.sog_mean_6h,
+        'sog_mean_24h', w.sog_mean_24h,
+        'stopped_share_6h', w.stopped_share_6h,
 
         'distance_nm_last', (
           SELECT ap.distance_nm::double precision
@@ -271,70 +251,132 @@ feat AS (
     ) AS extra
 
   FROM lbl l
-),
+  LEFT JOIN win_agg w
+    ON w.port_call_id = l.port_call_id
+  /*PORT_MEDIANS*/
+)
 
-do_update AS (
-  UPDATE public.ml_training_samples_multiport s
-  SET
-    label_wait_hours = f.label_wait_hours,
-    features = f.features,
-    confidence = f.confidence,
-    extra = f.extra
-  FROM feat f
+SELECT * FROM feat;
+"""
+
+# Land the staged rows: update matches on the sample key, insert the rest
+MERGE_UPDATE_SQL = """
+UPDATE public.ml_training_samples_multiport s
+SET
+  label_wait_hours = f.label_wait_hours,
+  features = f.features,
+  confidence = f.confidence,
+  extra = f.extra
+FROM stg_ttb f
+WHERE s.port_code = f.port_code
+  AND s.mmsi = f.mmsi
+  AND s.label_ts_utc = f.label_ts_utc
+  AND s.label_type = f.label_type;
+"""
+
+MERGE_INSERT_SQL = """
+INSERT INTO public.ml_training_samples_multiport (
+  port_code, mmsi, label_ts_utc, label_wait_hours, label_type,
+  features, confidence, extra
+)
+SELECT
+  f.port_code, f.mmsi, f.label_ts_utc, f.label_wait_hours, f.label_type,
+  f.features, f.confidence, f.extra
+FROM stg_ttb f
+WHERE NOT EXISTS (
+  SELECT 1
+  FROM public.ml_training_samples_multiport s
   WHERE s.port_code = f.port_code
     AND s.mmsi = f.mmsi
     AND s.label_ts_utc = f.label_ts_utc
     AND s.label_type = f.label_type
-  RETURNING 1
-),
-
-do_insert AS (
-  INSERT INTO public.ml_training_samples_multiport (
-    port_code, mmsi, label_ts_utc, label_wait_hours, label_type,
-    features, confidence, extra
-  )
-  SELECT
-    f.port_code, f.mmsi, f.label_ts_utc, f.label_wait_hours, f.label_type,
-    f.features, f.confidence, f.extra
-  FROM feat f
-  WHERE NOT EXISTS (
-    SELECT 1
-    FROM public.ml_training_samples_multiport s
-    WHERE s.port_code = f.port_code
-      AND s.mmsi = f.mmsi
-      AND s.label_ts_utc = f.label_ts_utc
-      AND s.label_type = f.label_type
-  )
-  RETURNING 1
-)
-
-SELECT
-  (SELECT COUNT(*) FROM do_update) AS updated_rows,
-  (SELECT COUNT(*) FROM do_insert) AS inserted_rows;
+);
 """
 
 def main() -> int:
     ap = argparse.ArgumentParser()
     ap.add_argument("--days-back", type=int, default=5000)
     ap.add_argument("--port-code", type=str, default=None)
+    ap.add_argument("--medians-mv", action="store_true", help="Take rolling port medians from mv_port_median_ttb (refreshed each run)")
+    ap.add_argument("--statement-timeout-ms", type=int, default=0, help="Per-statement timeout for the build session (0 = none, the default)")
+    ap.add_argument("--parallel-workers", type=int, default=None, help="max_parallel_workers_per_gather for the feature build (e.g. 4; default: server setting)")
+    ap.add_argument("--approx-distinct", action="store_true", help="Approximate 6h/24h congestion counts with HLL (needs the hll extension)")
     args = ap.parse_args()
 
     url = os.getenv("DATABASE_URL")
     if not url:
         raise SystemExit("Missing DATABASE_URL")
 
-    engine = create_engine(url, pool_pre_ping=True)
+    # Statements run one after another, so a single pooled connection is reused for the
+    # index DDL, MV refresh, since_ts probe and the merge. Durability is relaxed per session:
+    # the samples table is a rebuildable derivative of the labels.
+    engine = create_engine(
+        url,
+        pool_pre_ping=True,
+        pool_size=1,
+        isolation_level="READ COMMITTED",
+        connect_args={"options": f"-c synchronous_commit=off -c statement_timeout={args.statement_timeout_ms}"},
+    )
+
+    # The ais_win range per label is served index-only by idx_ais_pos_port_time_cover
+    # (port_code, timestamp_utc) INCLUDE (zone, mmsi, sog), created once by
+    # migrations/001_ais_positions_port_time_cover.sql. CONCURRENTLY needs autocommit
+    # (outside the upsert transaction).
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        # A cancelled CONCURRENTLY build leaves an INVALID index that IF NOT EXISTS then skips
+        conn.execute(text("SET statement_timeout = 0;"))
+        # Sample key lookup for the merge (UPDATE join / NOT EXISTS probe); label_type and
+        # port_code lead so each run only touches its own slice of the index.
+        conn.execute(text("""
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_ml_samples_type_port_key
+              ON public.ml_training_samples_multiport (label_type, port_code, mmsi, label_ts_utc);
+        """))
+        # Back to the startup default: this connection goes back to the pool for the merge
+        conn.execute(text("RESET statement_timeout;"))
+
+    if args.medians_mv:
+        with engine.begin() as conn:
+            conn.execute(text(PORT_MEDIANS_MV_DDL))
+            conn.execute(text("""
+                CREATE UNIQUE INDEX IF NOT EXISTS ux_mv_port_median_ttb
+                  ON public.mv_port_median_ttb (port_code, h);
+            """))
+        # Outside the upsert transaction: CONCURRENTLY keeps readers unblocked
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.execute(text("REFRESH MATERIALIZED VIEW CONCURRENTLY public.mv_port_median_ttb;"))
+        print("[TTB_TRAIN_V2] refreshed mv_port_median_ttb")
 
     with engine.begin() as conn:
         since_ts = conn.execute(
-            text("SELECT (now() AT TIME ZONE 'utc') - (:d || ' days')::interval;"),
+            text("SELECT (now() AT TIME ZONE 'utc') - make_interval(days => :d);"),
             {"d": args.days_back},
         ).scalar()
 
-        updated, inserted = conn.execute(
-            text(UPSERT_SQL),
+        wide = WIDE_DISTINCT_EXACT_SQL
+        if args.approx_distinct:
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS hll;"))
+            wide = WIDE_DISTINCT_HLL_SQL
+
+        # The features are one lbl-driven plan (win_agg join + medians lateral): let it fan
+        # out across parallel workers
+        if args.parallel_workers is not None:
+            conn.execute(text("SELECT set_config('max_parallel_workers_per_gather', :n, true);"),
+                         {"n": str(args.parallel_workers)})
+
+        medians = PORT_MEDIANS_LATERAL_SQL
+        if args.medians_mv:
+            medians = PORT_MEDIANS_MV_SQL
+
+        feat_sql = (FEAT_STAGE_SQL
+                    .replace("    /*WIDE_DISTINCT*/\n", wide.lstrip("\n"))
+                    .replace("  /*PORT_MEDIANS*/\n", medians.lstrip("\n")))
+        conn.execute(
+            text(feat_sql),
             {"since_ts": since_ts, "port_code": args.port_code},
-        ).one()
+        )
+        conn.execute(text("ANALYZE stg_ttb;"))
+        updated = conn.execute(text(MERGE_UPDATE_SQL)).rowcount
+        inserted = conn.execute(text(MERGE_INSERT_SQL)).rowcount
 
         total = conn.execute(
             text("SELECT COUNT(*)::bigint FROM public.ml_training_samples_multiport WHERE label_type='TTB';")
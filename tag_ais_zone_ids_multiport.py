@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+import os, sys, argparse
+from datetime import timedelta
+import psycopg2
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--ports", required=True)
+    ap.add_argument("--since-days", type=int, default=30)
+    ap.add_argument("--retag", action="store_true", help="Clear zone_mask in window first (zone/role edits are detected and cleared automatically)")
+    args = ap.parse_args()
+
+    db = os.getenv("DATABASE_URL")
+    if not db:
+        print("ERROR: DATABASE_URL not set", file=sys.stderr)
+        sys.exit(2)
+
+    ports = [p.strip().upper() for p in args.ports.split(",") if p.strip()]
+    if not ports:
+        print("ERROR: no ports", file=sys.stderr)
+        sys.exit(2)
+
+    # autocommit: each day batch commits on its own
+    conn = psycopg2.connect(db)
+    conn.autocommit = True
+    cur = conn.cursor()
+
+    print("=== TAG AIS ZONE IDS (ROLE MEMBERSHIP, BATCHED BY DAY) ===")
+    print(f"ports={ports} since_days={args.since_days} retag={args.retag}")
+
+    cur.execute("""
+        SELECT to_regclass('public.port_zone_subdiv') IS NOT NULL
+           AND to_regclass('public.port_zone_versions') IS NOT NULL
+    """)
+    if not cur.fetchone()[0]:
+        raise SystemExit("ERROR: public.port_zone_subdiv missing. Run build_port_calls_multiport.py first.")
+
+    # zone_id: one stable smallint per (port_code, role). Points store zone_mask, a bitmask of
+    # every role zone they fall in (bit = rank of the role's zone_id within its port, so bits
+    # never move as roles are appended; <= 15 roles per port): 0 = tagged, outside every role
+    # zone; NULL = not tagged yet.
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS public.port_zone_role_ids (
+          zone_id smallserial PRIMARY KEY,
+          port_code text NOT NULL,
+          role text NOT NULL,
+          UNIQUE (port_code, role)
+        );
+    """)
+    # ADD COLUMN takes ACCESS EXCLUSIVE on the ingestion-hot table even when the column
+    # exists, so only issue it once
+    cur.execute("""
+        SELECT EXISTS (
+          SELECT 1 FROM information_schema.columns
+          WHERE table_schema='public' AND table_name='ais_positions' AND column_name='zone_mask'
+        )
+    """)
+    if not cur.fetchone()[0]:
+        cur.execute("ALTER TABLE public.ais_positions ADD COLUMN IF NOT EXISTS zone_mask smallint;")
+    cur.execute("""
+        INSERT INTO public.port_zone_role_ids (port_code, role)
+        SELECT DISTINCT port_code, role FROM public.port_zone_subdiv
+        ON CONFLICT (port_code, role) DO NOTHING;
+    """)
+
+    for port in ports:
+        print(f"\n[ZONE_IDS] port={port}")
+
+        cur.execute("""
+            SELECT (now() AT TIME ZONE 'utc') - make_interval(days => %s),
+                   (now() AT TIME ZONE 'utc')
+        """, (args.since_days,))
+        since_ts, now_ts = cur.fetchone()
+
+        # Masks are tied to the zones/roles fingerprint they were tagged under (same
+        # fingerprint the builder keeps for the tiles): tiles must be current, and masks
+        # from an older fingerprint are cleared everywhere, not only in the window
+        cur.execute("""
+            SELECT
+              md5(string_agg(r.role || ':' || z.zone_name || ':' || md5(ST_AsEWKB(z.geom)), ',' ORDER BY r.role, z.zone_name))
+            FROM public.port_zones z
+            JOIN public.port_zone_roles r
+              ON r.port_code=z.port_code AND r.zone_name=z.zone_name
+            WHERE r.active=true AND r.port_code=%s
+        """, (port,))
+        zone_fp = cur.fetchone()[0]
+        cur.execute("SELECT subdiv_fp, mask_fp FROM public.port_zone_versions WHERE port_code=%s", (port,))
+        subdiv_fp, mask_fp = cur.fetchone() or (None, None)
+        if zone_fp is None or subdiv_fp != zone_fp:
+            raise SystemExit(f"ERROR: port_zone_subdiv is stale for {port}. Run build_port_calls_multiport.py first.")
+        if mask_fp != zone_fp:
+            cur.execute("""
+                UPDATE public.ais_positions
+                SET zone_mask = NULL
+                WHERE port_code=%s
+                  AND zone_mask IS NOT NULL
+            """, (port,))
+            print(f"  zones/roles changed since last tagging: cleared zone_mask on {cur.rowcount} points")
+        elif args.retag:
+            cur.execute("""
+                UPDATE public.ais_positions
+                SET zone_mask = NULL
+                WHERE port_code=%s
+                  AND zone_mask IS NOT NULL
+                  AND timestamp_utc >= %s
+            """, (port, since_ts))
+            print(f"  cleared zone_mask on {cur.rowcount} points")
+
+        # Points in overlapping role zones carry every role's bit (a QUEUE+BASIN point counts for both)
+        total = 0
+        lo = since_ts
+        while lo < now_ts:
+            hi = lo + timedelta(days=1)
+            cur.execute("""
+                WITH role_bits AS (
+                  SELECT port_code, role,
+                         (1 << (ROW_NUMBER() OVER (PARTITION BY port_code ORDER BY zone_id) - 1)::int)::smallint AS bit
+                  FROM public.port_zone_role_ids
+                  WHERE port_code = %s
+                )
+                UPDATE public.ais_positions ap
+                SET zone_mask = COALESCE((
+                  SELECT bit_or(rb.bit)
+                  FROM public.port_zone_subdiv s
+                  JOIN role_bits rb
+                    ON rb.port_code=s.port_code AND rb.role=s.role
+                  WHERE s.port_code = ap.port_code
+                    AND s.geom && ST_SetSRID(ST_Point(ap.lon, ap.lat), 4326)
+                    AND ST_Contains(s.geom, ST_SetSRID(ST_Point(ap.lon, ap.lat), 4326))
+                ), 0)
+                WHERE ap.port_code=%s
+                  AND ap.zone_mask IS NULL
+                  AND ap.timestamp_utc >= %s
+                  AND ap.timestamp_utc <  %s
+            """, (port, port, lo, hi))
+            total += cur.rowcount
+            lo = hi
+
+        print(f"  [OK] tagged points: {total}")
+        cur.execute("UPDATE public.port_zone_versions SET mask_fp = %s WHERE port_code=%s", (zone_fp, port))
+
+    cur.close()
+    conn.close()
+    print("\n=== DONE TAG AIS ZONE IDS ===")
+
+if __name__ == "__main__":
+    main()